@@ -11,6 +11,7 @@
 
 """Server that serves clients trying to work with the database."""
 
+import os
 import threading
 import socket
 import json
@@ -19,7 +20,8 @@ import argparse
 
 import sys
 sys.path.append("../modules")
-from Server.database import Database  # noqa
+from Common import processGroup  # noqa
+from Server.database import Database, MappedDatabase  # noqa
 from Server.Lock.readWriteLock import ReadWriteLock  # noqa
 
 # -----------------------------------------------------------------------------
@@ -43,6 +45,15 @@ parser.add_argument(
     "-f", "--file", metavar="FILE", dest="file", default="dbs/fortune.db",
     help="Set the database file. Default: dbs/fortune.db."
 )
+parser.add_argument(
+    "-w", "--workers", metavar="COUNT", dest="workers", type=int, default=1,
+    help="Serve the port from COUNT processes. Default: 1."
+)
+parser.add_argument(
+    "-m", "--mmap", action="store_true", dest="mmap", default=False,
+    help="Read the database through a memory map and an index file "
+         "instead of loading it in memory."
+)
 opts = parser.parse_args()
 
 db_file = opts.file
@@ -55,11 +66,18 @@ server_address = ("", opts.port)
 
 class Server(object):
 
-    """Class that provides synchronous access to the database."""
+    """Class that provides synchronous access to the database.
 
-    def __init__(self, db_file):
-        self.db = Database(db_file)
+    In a worker process, owner_address is the path of the owner
+    process' socket: writes are forwarded there and reads first load
+    the fortunes the owner has appended to the database file.
+
+    """
+
+    def __init__(self, db_file, db_class=Database):
+        self.db = db_class(db_file)
         self.rwlock = ReadWriteLock()
+        self.owner_address = None
 
     # Public methods
 
@@ -67,6 +85,8 @@ class Server(object):
         #
         # Your code here.
         #
+        if self.owner_address is not None:
+            self.db.refresh()
         self.rwlock.read_acquire()
         randomFortune = self.db.read()
         self.rwlock.read_release()
@@ -76,11 +96,28 @@ class Server(object):
         #
         # Your code here.
         #
+        if self.owner_address is not None:
+            return self.forward({"method": "write", "args": fortune})
         self.rwlock.write_acquire()
         self.db.write(fortune)
         self.rwlock.write_release()
         return
 
+    def forward(self, request):
+        """Send a request to the owner process, return its result."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.owner_address)
+            worker = sock.makefile(mode="rw")
+            worker.write(json.dumps(request) + '\n')
+            worker.flush()
+            data = json.loads(worker.readline())
+        finally:
+            sock.close()
+        if "error" in data:
+            raise Exception(data["error"]["name"])
+        return data["result"]
+
 
 class Request(threading.Thread):
 
@@ -164,26 +201,51 @@ class Request(threading.Thread):
 # -----------------------------------------------------------------------------
 
 
+def serve(server):
+    """Serve the connections of a listening socket."""
+    while True:
+        try:
+            conn, addr = server.accept()
+            req = Request(sync_db, conn, addr)
+            print("Serving a request from {0}".format(addr))
+            req.start()
+        except socket.error:
+            continue
+
+
 print("Listening to: {}:{}".format(socket.getfqdn(), opts.port))
 with open("srv_address.tmp", "w") as f:
     f.write("{}:{}\n".format(socket.getfqdn(), opts.port))
 
-sync_db = Server(db_file)
+# Load the database before forking: the workers share it with the owner.
+sync_db = Server(db_file, MappedDatabase if opts.mmap else Database)
+
+if opts.workers > 1:
+    assert processGroup.reuse_port_supported(), \
+        "Serving from several processes needs SO_REUSEPORT and fork."
+    owner_address = processGroup.owner_path(opts.port)
+    if processGroup.fork_workers(opts.workers - 1) != 0:
+        sync_db.owner_address = owner_address
+    else:
+        # The owner also serves the writes forwarded by the workers.
+        if os.path.exists(owner_address):
+            os.unlink(owner_address)
+        owner = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        owner.bind(owner_address)
+        owner.listen(16)
+        owner_thread = threading.Thread(target=serve, args=(owner,))
+        owner_thread.daemon = True
+        owner_thread.start()
 
 server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+if opts.workers > 1:
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 server.bind(server_address)
 server.listen(1)
 
 print("Press Ctrl-C to stop the server...")
 
 try:
-    while True:
-        try:
-            conn, addr = server.accept()
-            req = Request(sync_db, conn, addr)
-            print("Serving a request from {0}".format(addr))
-            req.start()
-        except socket.error:
-            continue
+    serve(server)
 except KeyboardInterrupt:
     pass
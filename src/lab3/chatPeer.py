@@ -60,6 +60,13 @@ class Client(orb.Peer):
 
     """Chat client class."""
 
+    # Remote methods reached through dispatched_calls.
+    remote_methods = {
+        "register_peer":     orb.RemoteMethod(),
+        "unregister_peer":   orb.RemoteMethod(oneway=True),
+        "display_peers":     orb.RemoteMethod()
+    }
+
     def __init__(self, local_address, ns_address, cient_type):
         """Initialize the client."""
         orb.Peer.__init__(self, local_address, ns_address, client_type)
@@ -75,8 +82,13 @@ class Client(orb.Peer):
     # Public methods
 
     def destroy(self):
-        orb.Peer.destroy(self)
         self.peer_list.destroy()
+        orb.Peer.destroy(self)
+
+    def moved(self, oid, ohash):
+        old_id = self.id
+        orb.Peer.moved(self, oid, ohash)
+        self.peer_list.moved(old_id)
 
     def __getattr__(self, attr):
         """Forward calls are dispatched here."""
@@ -86,12 +98,13 @@ class Client(orb.Peer):
             raise AttributeError(
                 "Client instance has no attribute '{}'".format(attr))
 
+    @orb.remote(oneway=True)
     def print_message(self, from_id, msg):
         print("Received a message from {}: {}".format(from_id, msg))
 
     def send_message(self, to_id, msg):
         try:
-            self.peer_list.peer(to_id).print_message(self.id, msg)
+            self.peer_list.peer(to_id).send("print_message", self.id, msg)
         except Exception:
             print(("Cannot send messages to {}."
                    "Make sure it is in the list of peers.").format(to_id))
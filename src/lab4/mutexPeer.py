@@ -57,6 +57,16 @@ class Client(orb.Peer):
 
     """Distributed mutual exclusion client class."""
 
+    # Remote methods reached through dispatched_calls.
+    remote_methods = {
+        "display_peers":      orb.RemoteMethod(),
+        "acquire":            orb.RemoteMethod(),
+        "release":            orb.RemoteMethod(),
+        "request_token":      orb.RemoteMethod(),
+        "obtain_token":       orb.RemoteMethod(oneway=True),
+        "display_status":     orb.RemoteMethod()
+    }
+
     def __init__(self, local_address, ns_address, cient_type):
         """Initialize the client."""
         orb.Peer.__init__(self, local_address, ns_address, client_type)
@@ -77,9 +87,15 @@ class Client(orb.Peer):
     # Public methods
 
     def destroy(self):
-        orb.Peer.destroy(self)
         self.distributed_lock.destroy()
         self.peer_list.destroy()
+        orb.Peer.destroy(self)
+
+    def moved(self, oid, ohash):
+        old_id = self.id
+        orb.Peer.moved(self, oid, ohash)
+        self.distributed_lock.moved(old_id)
+        self.peer_list.moved(old_id)
 
     def __getattr__(self, attr):
         """Forward calls are dispatched here."""
@@ -89,10 +105,12 @@ class Client(orb.Peer):
             raise AttributeError(
                 "Client instance has no attribute '{}'".format(attr))
 
+    @orb.remote
     def register_peer(self, pid, paddr):
         self.peer_list.register_peer(pid, paddr)
         self.distributed_lock.register_peer(pid)
 
+    @orb.remote(oneway=True)
     def unregister_peer(self, pid):
         self.peer_list.unregister_peer(pid)
         self.distributed_lock.unregister_peer(pid)
@@ -16,6 +16,7 @@ import argparse
 
 sys.path.append("../modules")
 from Common import orb
+from Common import nameCache
 from Common.nameServiceLocation import name_service_address
 from Common.objectType import object_type
 
@@ -44,6 +45,16 @@ parser.add_argument(
     "-p", "--peer", metavar="PEER_ID", dest="peer_id", type=int,
     help="The identifier of a particular server peer."
 )
+parser.add_argument(
+    "-n", "--count", metavar="COUNT", dest="count", type=int, default=1,
+    help="Read COUNT random fortunes, in a single round trip."
+)
+parser.add_argument(
+    "-b", "--balance", metavar="POLICY", dest="policy", default="p2c",
+    choices=["random", "p2c", "least"],
+    help="Choose the server at random, as the less loaded of two random "
+         "servers (p2c) or as the least loaded one. Default: p2c."
+)
 opts = parser.parse_args()
 
 server_type = opts.type
@@ -55,10 +66,10 @@ assert server_type != "object", "Change the object type to something unique!"
 # -----------------------------------------------------------------------------
 
 # Connect to the name service to obtain the address of the server.
-ns = orb.Stub(name_service_address)
+ns = nameCache.name_service(name_service_address)
 
 if server_id is None:
-    server_address = tuple(ns.require_any(server_type))
+    server_address = tuple(ns.require_any(server_type, opts.policy))
 else:
     server_address = tuple(ns.require_object(server_type, server_id))
 
@@ -72,6 +83,11 @@ if not opts.interactive:
     if opts.fortune is not None:
         print("Writing '{}' to the fortune database.".format(opts.fortune))
         db.write(opts.fortune)
+    elif opts.count > 1:
+        with db.batch() as batch:
+            fortunes = [batch.read() for _ in range(opts.count)]
+        for fortune in fortunes:
+            print(fortune.result())
     else:
         print(db.read())
 
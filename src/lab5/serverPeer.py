@@ -24,6 +24,9 @@ import argparse
 
 sys.path.append("../modules")
 from Common import orb
+from Common import metrics
+from Common import processGroup
+from Common.asyncOrb import AsyncSkeleton
 from Common.nameServiceLocation import name_service_address
 from Common.objectType import object_type
 
@@ -54,6 +57,20 @@ parser.add_argument(
     "-f", "--file", metavar="FILE", dest="file", default="dbs/fortune.db",
     help="Set the database file. Default: dbs/fortune.db."
 )
+parser.add_argument(
+    "-a", "--asyncio", action="store_true", dest="asyncio", default=False,
+    help="Serve requests from an asyncio event loop instead of one thread "
+         "per connection."
+)
+parser.add_argument(
+    "-w", "--workers", metavar="COUNT", dest="workers", type=int, default=1,
+    help="Serve the port from COUNT processes. Default: 1."
+)
+parser.add_argument(
+    "-m", "--mmap", action="store_true", dest="mmap", default=False,
+    help="Read the database through a memory map and an index file "
+         "instead of loading it in memory."
+)
 opts = parser.parse_args()
 
 local_port = opts.port
@@ -61,6 +78,9 @@ db_file = opts.file
 server_type = opts.type
 assert server_type != "object", "Change the object type to something unique!"
 
+# Seconds to wait for a replica to write a fortune.
+REPLICATION_TIMEOUT = 10.0
+
 
 # -----------------------------------------------------------------------------
 # Auxiliary classes
@@ -71,14 +91,30 @@ class Server(orb.Peer):
 
     """Distributed mutual exclusion client class."""
 
-    def __init__(self, local_address, ns_address, server_type, db_file):
-        """Initialize the client."""
+    # Remote methods reached through dispatched_calls.
+    remote_methods = {
+        "display_peers":      orb.RemoteMethod(),
+        "acquire":            orb.RemoteMethod(),
+        "release":            orb.RemoteMethod(),
+        "request_token":      orb.RemoteMethod(),
+        "obtain_token":       orb.RemoteMethod(oneway=True),
+        "display_status":     orb.RemoteMethod()
+    }
+
+    def __init__(self, local_address, ns_address, server_type, db_file,
+                 skeleton_class=None, db=None, **skeleton_args):
+        """Initialize the client.
 
-        orb.Peer.__init__(self, local_address, ns_address, server_type)
+        db is the already loaded database of db_file, if any.
+
+        """
+
+        orb.Peer.__init__(self, local_address, ns_address, server_type,
+                          skeleton_class, **skeleton_args)
         self.peer_list = PeerList(self)
         self.distributed_lock = DistributedLock(self, self.peer_list)
         self.drwlock = DistributedReadWriteLock(self.distributed_lock)
-        self.db = database.Database(db_file)
+        self.db = db if db is not None else database.Database(db_file)
         self.dispatched_calls = {
             "display_peers":      self.peer_list.display_peers,
             "acquire":            self.distributed_lock.acquire,
@@ -94,9 +130,16 @@ class Server(orb.Peer):
     # Public methods
 
     def destroy(self):
-        orb.Peer.destroy(self)
         self.distributed_lock.destroy()
         self.peer_list.destroy()
+        # Last, so that the calls of the other peers are still answered.
+        orb.Peer.destroy(self)
+
+    def moved(self, oid, ohash):
+        old_id = self.id
+        orb.Peer.moved(self, oid, ohash)
+        self.distributed_lock.moved(old_id)
+        self.peer_list.moved(old_id)
 
     def __getattr__(self, attr):
         """Forward calls are dispatched here."""
@@ -109,6 +152,7 @@ class Server(orb.Peer):
 
     # Public methods
 
+    @orb.remote
     def read(self):
         """Read a fortune from the database."""
 
@@ -120,6 +164,7 @@ class Server(orb.Peer):
         self.drwlock.read_release()
         return randomFortune
 
+    @orb.remote
     def write(self, fortune):
         """Write a fortune to the database.
 
@@ -133,16 +178,16 @@ class Server(orb.Peer):
         try:
             self.db.write(fortune)
             peers = self.peer_list.get_peers()
-            for pid in peers:
-                try:
-                    if pid is not self.id:
-                        peers[pid].write_local(fortune)
-                except:
-                    continue
+            # Replicate to all peers in parallel.
+            orb.gather({
+                pid: peers[pid].call_async("write_local", fortune)
+                for pid in peers if pid != self.id
+            }, REPLICATION_TIMEOUT)
         finally:
             self.drwlock.write_release()
 
 
+    @orb.remote
     def write_local(self, fortune):
         """Write a fortune to the database.
 
@@ -157,25 +202,99 @@ class Server(orb.Peer):
         finally:
             self.drwlock.write_release_local()
 
+    @orb.remote
     def register_peer(self, pid, paddr):
         """Register a server peer in this server's peer list."""
 
         self.peer_list.register_peer(pid, paddr)
         self.distributed_lock.register_peer(pid)
 
+    @orb.remote(oneway=True)
     def unregister_peer(self, pid):
         """Remove a server peer from this server's peer list."""
 
         self.peer_list.unregister_peer(pid)
         self.distributed_lock.unregister_peer(pid)
 
+
+class Worker(object):
+
+    """Worker process of a server started with several processes.
+
+    Workers serve reads from their copy of the database, which they
+    keep up to date with the fortunes the owner appends to the file,
+    and answer check and orb_metrics for their own process. Every other
+    call, including writes, is forwarded to the owner process, which is
+    the one taking part in the distributed system.
+
+    """
+
+    def __init__(self, db, owner_address):
+        self.db = db
+        self.owner = orb.Stub(owner_address)
+        self.identity = None
+
+    # Public methods
+
+    def read(self):
+        """Read a fortune from the database."""
+
+        self.db.refresh()
+        return self.db.read()
+
+    def check(self):
+        """Checking to see if the object is still alive.
+
+        Answered by the worker itself, with the id and type of the
+        owner, so that it tells whether this process is alive.
+
+        """
+
+        if self.identity is None:
+            self.identity = self.owner.call_async("check").result()
+        return self.identity
+
+    def orb_metrics(self):
+        """Return the metrics of the remote calls of this process."""
+
+        return metrics.snapshot()
+
+    def __getattr__(self, attr):
+        """Calls of the owner's methods are forwarded here."""
+
+        if attr.startswith("_"):
+            raise AttributeError(
+                "Worker instance has no attribute '{0}'".format(attr))
+
+        def forward(*args):
+            return self.owner.call_async(attr, *args).result()
+        return forward
+
 # -----------------------------------------------------------------------------
 # The main program
 # -----------------------------------------------------------------------------
 
 # Initialize the client object.
 local_address = (socket.getfqdn(), local_port)
-p = Server(local_address, name_service_address, server_type, db_file)
+skeleton_class = AsyncSkeleton if opts.asyncio else None
+db_class = database.MappedDatabase if opts.mmap else database.Database
+if opts.workers > 1:
+    assert processGroup.reuse_port_supported(), \
+        "Serving from several processes needs SO_REUSEPORT and fork."
+    # Load the database once, the workers share it with the owner.
+    db = db_class(db_file)
+    owner_address = processGroup.owner_path(local_port)
+    if processGroup.fork_workers(opts.workers - 1) != 0:
+        worker_class = skeleton_class or orb.Skeleton
+        worker_class(Worker(db, owner_address), ('', local_port),
+                     reuse_port=True).start()
+        processGroup.wait_forever()
+        sys.exit(0)
+    p = Server(local_address, name_service_address, server_type, db_file,
+               skeleton_class, db, reuse_port=True, unix_path=owner_address)
+else:
+    p = Server(local_address, name_service_address, server_type, db_file,
+               skeleton_class, db_class(db_file))
 
 
 def menu():
@@ -0,0 +1,519 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Added to the lab framework: 18 October 2026
+# (not part of the original course material)
+# -----------------------------------------------------------------------------
+
+"""asyncio transport for the Object Request Broker.
+
+This module speaks the same protocol as Common.orb (framed messages
+with a negotiated codec, or JSON lines for old callers), but serves
+and issues calls from a single event loop instead of one thread per
+connection:
+
+--  AsyncSkeleton ::
+        Drop-in replacement for orb.Skeleton. Connections are handled
+        by coroutines, so idle connections only cost a few kilobytes.
+        Owner methods are ordinary blocking functions and are run on a
+        thread pool executor.
+--  AsyncStub ::
+        Image of a remote object whose methods are awaitable. All calls
+        to one address are multiplexed over a single connection.
+
+"""
+
+import asyncio
+import collections.abc
+import itertools
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from Common import metrics
+from Common import orb
+
+# Longest request line accepted from a caller, in bytes.
+LINE_LIMIT = 16 * 1024 * 1024
+
+# Seconds between two checks for the end of the calls in flight.
+DRAIN_INTERVAL = 0.05
+
+
+def encode(message, codec, compressor=None):
+    """Serialize a message for the wire: a frame, or a JSON line."""
+    if codec is None:
+        return json.dumps(message).encode() + b'\n'
+    return b"".join(orb.encode_frame(codec.encode(message), compressor))
+
+
+class Flow(object):
+
+    """Credits granted by the caller to a stream, on the event loop."""
+
+    def __init__(self, credits):
+        self.credits = credits
+        self.cancelled = False
+        self.changed = asyncio.Event()
+
+    def grant(self, credits):
+        self.credits += credits
+        self.changed.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self.changed.set()
+
+    async def take(self, timeout=None):
+        """Use up a credit, waiting for one; False if none comes."""
+        if not self.credits and not self.cancelled:
+            self.changed.clear()
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self.cancelled or not self.credits:
+            return False
+        self.credits -= 1
+        return True
+
+
+class AsyncSkeleton(threading.Thread):
+
+    """Skeleton that serves its owner from an asyncio event loop.
+
+    The event loop runs on the skeleton's own thread, so the skeleton
+    is started and used exactly like orb.Skeleton (for instance through
+    orb.Peer's skeleton_class argument), and stopped like it too.
+
+    """
+
+    def __init__(self, owner, address, max_workers=32, backlog=1024,
+                 interceptors=None, unix_path=None, reuse_port=False):
+        threading.Thread.__init__(self)
+        self.address = address
+        self.owner = owner
+        self.daemon = True
+        self.backlog = backlog
+        self.interceptors = interceptors
+        self.unix_path = unix_path
+        self.reuse_port = reuse_port
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.dispatcher = None
+        self.loop = None
+        self.finished = None
+        self.servers = []
+        self.writers = set()
+        self.stopping = False
+        self.in_flight = 0
+
+    def start(self):
+        self.dispatcher = orb.Dispatcher(self.owner, self.interceptors)
+        orb.local_skeletons[self.address[1]] = self
+        threading.Thread.start(self)
+
+    def submit(self, request):
+        """Serve a request of this process (see orb.Dispatcher.submit)."""
+        return self.dispatcher.submit(request, self.executor.submit)
+
+    def load(self):
+        """Return the number of calls in flight and waiting for a worker.
+
+        The executor does not tell how many calls wait for it, so those
+        in flight beyond max_workers are counted as waiting.
+
+        """
+        return [self.in_flight, max(0, self.in_flight - self.max_workers)]
+
+    def stop(self, drain_timeout=None):
+        """Stop serving, without dropping the calls in flight.
+
+        See orb.Skeleton.stop; must not be called from the event loop.
+
+        """
+        if self.finished is None:
+            self.stopping = True
+            return 0
+        left = asyncio.run_coroutine_threadsafe(
+            self._stop(drain_timeout), self.loop).result()
+        self.loop.call_soon_threadsafe(self.finished.set_result, None)
+        if left:
+            print("Skeleton stopped with {} calls in flight.".format(left))
+        return left
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._listen())
+        except Exception as e:
+            print(e)
+        finally:
+            self.loop.close()
+            self.executor.shutdown(wait=False)
+
+    # Private methods
+
+    async def _listen(self):
+        host, port = self.address
+        self.servers.append(await asyncio.start_server(
+            self._handle, host or None, port, backlog=self.backlog,
+            reuse_address=True, reuse_port=self.reuse_port or None,
+            limit=LINE_LIMIT))
+        if self.unix_path is not None and hasattr(socket, "AF_UNIX"):
+            # We own the TCP port, so any file left at the path is stale.
+            if os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            self.servers.append(await asyncio.start_unix_server(
+                self._handle, self.unix_path, backlog=self.backlog,
+                limit=LINE_LIMIT))
+        self.finished = self.loop.create_future()
+        if self.stopping:
+            await self._stop(0)
+        else:
+            await self.finished
+
+    async def _stop(self, drain_timeout):
+        """Stop accepting, drain the calls in flight, return those left."""
+        self.stopping = True
+        if orb.local_skeletons.get(self.address[1]) is self:
+            del orb.local_skeletons[self.address[1]]
+        for server in self.servers:
+            server.close()
+        if self.unix_path is not None and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+        if drain_timeout is not None:
+            deadline = self.loop.time() + drain_timeout
+        while self.in_flight and (drain_timeout is None or
+                                  self.loop.time() < deadline):
+            await asyncio.sleep(DRAIN_INTERVAL)
+        for writer in list(self.writers):
+            writer.close()
+        return self.in_flight
+
+    async def _handle(self, reader, writer):
+        """Serve requests on one connection until the caller closes it."""
+        tasks = set()
+        flows = {}
+        self.writers.add(writer)
+        try:
+            first = await reader.readexactly(1)
+            if first == orb.MAGIC[:1]:
+                opening = await reader.readexactly(len(orb.MAGIC))
+                if first + opening[:-1] != orb.MAGIC:
+                    raise orb.CommunicationError(
+                        "Malformed connection opening")
+                offer = await reader.readexactly(opening[-1])
+                codec = orb.choose_codec(offer)
+                compressor = orb.choose_compressor(offer)
+                writer.write(orb.encode_answer(codec, compressor))
+                receive = self._frame_receiver(reader, codec, compressor)
+                wire = (codec, compressor)
+            else:
+                receive = self._line_receiver(reader, first)
+                wire = (None, None)
+            while True:
+                request, size = await receive()
+                if request is None:
+                    break
+                if 'credit' in request or 'cancel' in request:
+                    # Flow control of a stream.
+                    flow = flows.get(request.get('id'))
+                    if flow is None:
+                        pass
+                    elif request.get('cancel'):
+                        flow.cancel()
+                    else:
+                        flow.grant(request['credit'])
+                    continue
+                deadline = orb.request_deadline(request)
+                try:
+                    export = self.dispatcher.accept(request)
+                except Exception as e:
+                    if not request.get('oneway'):
+                        self._reply(request, orb.error_response(e),
+                                    writer, wire)
+                    continue
+                self.dispatcher.stats(request).received(size)
+                if self.stopping:
+                    if not request.get('oneway'):
+                        self._reply(request,
+                                    orb.busy_response("Server is stopping"),
+                                    writer, wire)
+                    continue
+                self.in_flight += 1
+                flow = None
+                if request.get('stream') and 'id' in request:
+                    flow = flows[request['id']] = Flow(request['stream'])
+                if export is not None:
+                    if export.oneway and not request.get('oneway'):
+                        # Acknowledge declared one-way methods at once.
+                        self._reply(request, {"result": None}, writer, wire)
+                        request = dict(request, oneway=True)
+                    if (export.executor == orb.INLINE and
+                            not request.get('stream')):
+                        try:
+                            response = self.dispatcher.process(request,
+                                                               deadline)
+                            if not request.get('oneway'):
+                                self._reply(request, response, writer, wire)
+                        finally:
+                            self.in_flight -= 1
+                        continue
+                if 'id' in request or request.get('oneway'):
+                    task = asyncio.ensure_future(
+                        self._serve(request, deadline, writer, wire, flow))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    if flow is not None:
+                        task.add_done_callback(
+                            lambda _, rid=request['id']: flows.pop(rid, None))
+                else:
+                    await self._serve(request, deadline, writer, wire)
+        except (ConnectionError, ValueError, struct.error,
+                asyncio.IncompleteReadError, orb.CommunicationError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.writers.discard(writer)
+            writer.close()
+
+    def _frame_receiver(self, reader, codec, compressor):
+        """Return a coroutine function reading (message, size) frames."""
+        async def receive():
+            header = await reader.read(orb.FRAME.size)
+            if not header:
+                return None, 0
+            if len(header) < orb.FRAME.size:
+                header += await reader.readexactly(
+                    orb.FRAME.size - len(header))
+            size, compressed = orb.decode_header(header)
+            data = orb.decode_payload(await reader.readexactly(size),
+                                      compressed, compressor)
+            return codec.decode(data), orb.FRAME.size + size
+        return receive
+
+    def _line_receiver(self, reader, first):
+        """Return a coroutine function reading (message, size) lines."""
+        pending = [first]
+
+        async def receive():
+            line = await reader.readline()
+            if pending:
+                line = pending.pop() + line
+            if not line.strip():
+                return None, 0
+            return json.loads(line), len(line)
+        return receive
+
+    async def _serve(self, request, deadline, writer, wire, flow=None):
+        """Run a request on the executor and send back its response."""
+        try:
+            response = await self.loop.run_in_executor(
+                self.executor, self.dispatcher.process, request, deadline)
+            if isinstance(response.get('result'), collections.abc.Iterator):
+                await self._stream(request, response['result'], writer,
+                                   wire, flow)
+                return
+            if request.get('oneway'):
+                return
+            self._reply(request, response, writer, wire)
+            await writer.drain()
+        finally:
+            self.in_flight -= 1
+
+    async def _stream(self, request, iterator, writer, wire, flow):
+        """Send the items of iterator back, one chunk per credit.
+
+        The items are produced on the executor, as the owner's iterator
+        may block.
+
+        """
+        try:
+            if flow is None:
+                # Without an id, the caller cannot tell chunks apart.
+                result = await self.loop.run_in_executor(
+                    self.executor, list, iterator)
+                self._reply(request, {"result": result}, writer, wire)
+                return
+            chunks = orb.chunks(iterator, orb.STREAM_CHUNK)
+            while await flow.take(orb.STREAM_TIMEOUT):
+                chunk = await self.loop.run_in_executor(
+                    self.executor, next, chunks, None)
+                if chunk is None:
+                    self._reply(request, {"result": None}, writer, wire)
+                    break
+                self._reply(request, {"chunk": chunk}, writer, wire)
+                await writer.drain()
+        except Exception as e:
+            self._reply(request, orb.error_response(e), writer, wire)
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except ValueError:
+                    # Still running on the executor: left to the GC.
+                    pass
+
+    def _reply(self, request, response, writer, wire):
+        """Queue the response to a request on the connection.
+
+        wire is the (codec, compressor) of the connection, both None for
+        JSON lines.
+
+        """
+        response = self.dispatcher.respond(request, response)
+        if 'id' in request:
+            response['id'] = request['id']
+        try:
+            data = encode(response, *wire)
+        except (TypeError, ValueError) as e:
+            # The result cannot be encoded, report that instead.
+            data = encode(dict(orb.error_response(e),
+                               id=response.get('id')), *wire)
+        writer.write(data)
+        stats = self.dispatcher.stats(request)
+        if stats is not None:
+            stats.sent(len(data))
+
+
+class AsyncStub(object):
+
+    """Stub whose remote calls are coroutines.
+
+    Unlike orb.Stub, errors raised by the remote object are raised by
+    the awaited call instead of being returned as a value. timeout
+    bounds, in seconds, how long a call waits for its response; it
+    travels with the request like orb.Stub's. Calls are recorded in
+    metrics.client like those of orb.Stub.
+
+    """
+
+    def __init__(self, address, codecs=None, timeout=None,
+                 compressions=None):
+        self.address = tuple(address)
+        self.codecs = codecs
+        self.compressions = compressions
+        self.timeout = timeout
+        self.codec = None
+        self.compressor = None
+        self.reader = None
+        self.writer = None
+        self.receiver = None
+        self.connect_lock = asyncio.Lock()
+        self.ids = itertools.count()
+        # id -> (future, method) of the calls waiting for a response
+        self.pending = {}
+
+    async def close(self):
+        """Close the connection to the remote object."""
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.writer = None
+
+    async def send(self, method, *args):
+        """Call method one-way, without waiting for a response."""
+        stats = metrics.client.method(method)
+        stats.start()
+        start = time.monotonic()
+        failed = True
+        try:
+            await self._connect()
+            request = {"method": method, "args": args, "oneway": True}
+            data = encode(request, self.codec, self.compressor)
+            self.writer.write(data)
+            stats.sent(len(data))
+            await self.writer.drain()
+            failed = False
+        finally:
+            stats.finish(time.monotonic() - start, failed)
+
+    # Private methods
+
+    async def _connect(self):
+        async with self.connect_lock:
+            if self.writer is None or self.writer.is_closing():
+                self.reader, self.writer = await asyncio.open_connection(
+                    *self.address, limit=LINE_LIMIT)
+                compressions = self.compressions
+                if compressions is None:
+                    compressions = list(orb.compressors)
+                self.writer.write(orb.encode_offer(
+                    self.codecs or list(orb.codecs), compressions))
+                answer = await self.reader.readexactly(len(orb.MAGIC) + 1)
+                if not answer.startswith(orb.MAGIC):
+                    raise orb.CommunicationError(
+                        "Unexpected answer to codec negotiation")
+                self.codec, self.compressor = orb.decode_answer(
+                    await self.reader.readexactly(answer[-1]))
+                self.receiver = asyncio.ensure_future(self._receive())
+
+    async def _receive(self):
+        """Hand every incoming response to the future waiting for it."""
+        try:
+            while True:
+                header = await self.reader.readexactly(orb.FRAME.size)
+                size, compressed = orb.decode_header(header)
+                response = self.codec.decode(orb.decode_payload(
+                    await self.reader.readexactly(size), compressed,
+                    self.compressor))
+                entry = self.pending.pop(response.pop("id", None), None)
+                if entry is None:
+                    continue
+                future, method = entry
+                metrics.client.method(method).received(
+                    orb.FRAME.size + size)
+                if not future.done():
+                    future.set_result(response)
+        except (ConnectionError, ValueError, struct.error,
+                asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writer.close()
+            pending, self.pending = self.pending, {}
+            for future, _ in pending.values():
+                if not future.done():
+                    future.set_exception(orb.CommunicationError(
+                        "Connection closed by {}".format(self.address)))
+
+    async def _rmi(self, method, *args):
+        stats = metrics.client.method(method)
+        stats.start()
+        start = time.monotonic()
+        response = None
+        rid = next(self.ids)
+        try:
+            await self._connect()
+            future = asyncio.get_running_loop().create_future()
+            self.pending[rid] = (future, method)
+            request = {"method": method, "args": args, "id": rid}
+            if self.timeout is not None:
+                request["deadline"] = self.timeout
+            data = encode(request, self.codec, self.compressor)
+            self.writer.write(data)
+            stats.sent(len(data))
+            await self.writer.drain()
+            try:
+                response = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                raise orb.DeadlineExceeded(
+                    "No response from {} in time".format(self.address))
+            return orb.unpack_response(response)
+        finally:
+            self.pending.pop(rid, None)
+            stats.finish(time.monotonic() - start,
+                         response is None or 'error' in response)
+
+    def __getattr__(self, attr):
+        """Forward call to name over the network at the given address."""
+        async def rmi_call(*args):
+            return await self._rmi(attr, *args)
+        return rmi_call
@@ -0,0 +1,241 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Added to the lab framework: 18 October 2026
+# (not part of the original course material)
+# -----------------------------------------------------------------------------
+
+"""Per-method metrics of remote calls.
+
+The ORB records, for every remote method, on the client side (calls
+made through stubs) and on the server side (calls run by skeletons):
+
+--  the number of calls and of failed calls,
+--  the number of calls in flight,
+--  the number of bytes sent and received,
+--  a latency histogram, from which percentiles are computed.
+
+All of it is kept in the module-level MetricSets client and server.
+The effect of compression is kept, per compressor, in compression.
+snapshot() returns it all in a form that can be sent over the network.
+
+"""
+
+import threading
+
+
+class Histogram(object):
+
+    """Latency histogram with HDR-style log-linear buckets.
+
+    Values are recorded in microseconds. The first 2**SUB_BITS buckets
+    are one microsecond wide; after that, every group of 2**SUB_BITS
+    buckets is twice as wide as the previous one. Recording is O(1)
+    and the relative error of any percentile stays below 2**-SUB_BITS.
+
+    """
+
+    SUB_BITS = 4
+    SUB_COUNT = 1 << SUB_BITS
+
+    def __init__(self):
+        self.counts = [0] * (64 * self.SUB_COUNT)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds):
+        """Add one value, given in seconds."""
+        value = max(0, int(seconds * 1e6))
+        if value < self.SUB_COUNT:
+            index = value
+        else:
+            shift = value.bit_length() - self.SUB_BITS - 1
+            index = (shift + 1) * self.SUB_COUNT + \
+                (value >> shift) - self.SUB_COUNT
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """Return the given percentile, in seconds (0 if empty)."""
+        if self.count == 0:
+            return 0.0
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._value(index), self.max) / 1e6
+        return self.max / 1e6
+
+    def mean(self):
+        """Return the mean value, in seconds (0 if empty)."""
+        return self.total / self.count / 1e6 if self.count else 0.0
+
+    # Private methods
+
+    def _value(self, index):
+        """Return the middle of the values recorded in a bucket."""
+        if index < self.SUB_COUNT:
+            return index
+        shift = index // self.SUB_COUNT - 1
+        low = (index % self.SUB_COUNT + self.SUB_COUNT) << shift
+        return low + ((1 << shift) >> 1)
+
+
+class MethodStats(object):
+
+    """Counters of one remote method, on one side of the connection."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = Histogram()
+
+    # Public methods
+
+    def start(self):
+        """A call has started."""
+        self.lock.acquire()
+        try:
+            self.in_flight += 1
+        finally:
+            self.lock.release()
+
+    def finish(self, seconds, failed):
+        """A call started with start() has ended after seconds."""
+        self.lock.acquire()
+        try:
+            self.in_flight -= 1
+            self.calls += 1
+            if failed:
+                self.errors += 1
+            self.latency.record(seconds)
+        finally:
+            self.lock.release()
+
+    def sent(self, size):
+        """size bytes have been sent for the method."""
+        self.lock.acquire()
+        try:
+            self.bytes_out += size
+        finally:
+            self.lock.release()
+
+    def received(self, size):
+        """size bytes have been received for the method."""
+        self.lock.acquire()
+        try:
+            self.bytes_in += size
+        finally:
+            self.lock.release()
+
+    def snapshot(self):
+        """Return the counters as a dictionary."""
+        self.lock.acquire()
+        try:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "latency": {
+                    "mean": self.latency.mean(),
+                    "p50": self.latency.percentile(50),
+                    "p90": self.latency.percentile(90),
+                    "p99": self.latency.percentile(99),
+                    "p999": self.latency.percentile(99.9),
+                    "max": self.latency.max / 1e6
+                }
+            }
+        finally:
+            self.lock.release()
+
+
+class MetricSet(object):
+
+    """The MethodStats of every method seen on one side."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods = {}
+
+    def method(self, name):
+        """Return the MethodStats of name, creating it if needed."""
+        stats = self.methods.get(name)
+        if stats is None:
+            self.lock.acquire()
+            try:
+                stats = self.methods.setdefault(name, MethodStats())
+            finally:
+                self.lock.release()
+        return stats
+
+    def in_flight(self):
+        """Return the number of calls in flight, over all methods."""
+        return sum(stats.in_flight for stats in list(self.methods.values()))
+
+    def snapshot(self):
+        """Return the counters of all methods as a dictionary."""
+        return {name: stats.snapshot()
+                for name, stats in list(self.methods.items())}
+
+
+class CompressionStats(object):
+
+    """Message sizes before and after compression, per compressor."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.compressors = {}
+
+    # Public methods
+
+    def compressed(self, name, raw, packed):
+        """A message of raw bytes has been sent as packed bytes."""
+        self._add(name, "out", raw, packed)
+
+    def decompressed(self, name, raw, packed):
+        """A message of raw bytes has been received as packed bytes."""
+        self._add(name, "in", raw, packed)
+
+    def snapshot(self):
+        """Return the counters of all compressors as a dictionary."""
+        self.lock.acquire()
+        try:
+            return {name: dict(counters)
+                    for name, counters in self.compressors.items()}
+        finally:
+            self.lock.release()
+
+    # Private methods
+
+    def _add(self, name, direction, raw, packed):
+        self.lock.acquire()
+        try:
+            counters = self.compressors.setdefault(name, {
+                "messages_in": 0, "raw_in": 0, "packed_in": 0,
+                "messages_out": 0, "raw_out": 0, "packed_out": 0})
+            counters["messages_" + direction] += 1
+            counters["raw_" + direction] += raw
+            counters["packed_" + direction] += packed
+        finally:
+            self.lock.release()
+
+
+client = MetricSet()
+server = MetricSet()
+compression = CompressionStats()
+
+
+def snapshot():
+    """Return all the metrics of this process as a dictionary."""
+    return {"client": client.snapshot(), "server": server.snapshot(),
+            "compression": compression.snapshot()}
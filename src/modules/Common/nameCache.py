@@ -0,0 +1,368 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Added to the lab framework: 18 October 2026
+# (not part of the original course material)
+# -----------------------------------------------------------------------------
+
+"""Caching client of the name service.
+
+A NameCache is used in place of a stub of the name service. It answers
+require_all, require_any and require_object from what the name service
+returned during the last TTL seconds, and forwards every other call.
+
+What it caches may be out of date: a cached object may have left. As
+it hooks into the failures of all the stubs of the process (see
+orb.failure_hooks), a call to a cached address that cannot be delivered
+drops the cached entries holding that address, and the next lookup asks
+the name service again.
+
+It also keeps the leases of the objects it registered with a lease: a
+background thread renews all of them with a single call, every third of
+the lease. The objects registered with a load function report their
+load with the renewals, which are then sent every REPORT_INTERVAL. An
+object whose lease was lost anyway, say while the name service was out
+of reach, is registered again, under a new id.
+
+"""
+
+import random
+import threading
+import time
+
+from . import orb
+
+# Seconds during which an answer of the name service is reused.
+DEFAULT_TTL = 10.0
+
+# Seconds between two reports of the load of the objects registered
+# with a load function.
+REPORT_INTERVAL = 2.0
+
+
+class NameCache(object):
+
+    """Caching stub of the name service at address.
+
+    register and unregister go to the name service and drop the cached
+    objects of their type, so that a process sees its own changes.
+    A name service without leases gets registrations without them.
+    Like those of orb.Stub, errors are returned rather than raised.
+
+    """
+
+    def __init__(self, address, ttl=DEFAULT_TTL, stub=None):
+        self.name_service = stub if stub is not None else orb.Stub(address)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.random = random.Random()
+        # type -> (expiry, [(id, address), ...])
+        self.types = {}
+        # (type, id) -> (expiry, address)
+        self.objects = {}
+        # address -> set of the keys of types and objects holding it
+        self.holders = {}
+        # (id, type) -> (hash, lease, load function, address, moved) of
+        # the leases to renew
+        self.leases = {}
+        self.renewed = threading.Condition(self.lock)
+        self.renewer = None
+        self.closed = False
+        orb.failure_hooks.append(self.call_failed)
+
+    # Public methods
+
+    def require_all(self, otype):
+        """Return the [id, address] pairs of all objects of a type."""
+        objects = self._objects(otype)
+        if isinstance(objects, Exception):
+            return objects
+        return [[oid, plain_address(address)] for oid, address in objects]
+
+    def require_any(self, otype, policy=None):
+        """Return the address of an object of a type.
+
+        Without a policy, the object is chosen at random among the
+        cached ones. Otherwise the choice is left to the name service,
+        which knows the loads of the objects (see
+        NameService.require_any), unless it has no policies.
+
+        """
+        if policy is not None:
+            address = self.name_service.require_any(otype, policy)
+            if not isinstance(address, Exception):
+                return address
+        objects = self._objects(otype)
+        if isinstance(objects, Exception) or not objects:
+            # Let the name service report the error.
+            return self.name_service.require_any(otype)
+        return plain_address(self.random.choice(objects)[1])
+
+    def require_object(self, otype, oid):
+        """Return the address of the object of a type with a given id."""
+        key = (otype, oid)
+        now = time.monotonic()
+        self.lock.acquire()
+        try:
+            entry = self.objects.get(key)
+            if entry is not None and entry[0] > now:
+                return plain_address(entry[1])
+            entry = self.types.get(otype)
+            if entry is not None and entry[0] > now:
+                for cached_id, address in entry[1]:
+                    if cached_id == oid:
+                        return plain_address(address)
+        finally:
+            self.lock.release()
+        address = self.name_service.require_object(otype, oid)
+        if isinstance(address, Exception):
+            return address
+        self._store(self.objects, key, cache_key(address), [address])
+        return address
+
+    def register(self, otype, address, lease=None, load=None, moved=None):
+        """Register an object with the name service.
+
+        Unless lease is None, the registration lasts lease seconds and
+        is renewed in the background until the object unregisters. The
+        load function, if any, returns the load reported with the
+        renewals: the number of calls in flight and of calls queued.
+        If the lease is lost, the object is registered again and moved,
+        if given, is called with its new id and hash.
+
+        """
+        if lease is None:
+            result = self.name_service.register(otype, address)
+        else:
+            result = self.name_service.register(otype, address, lease)
+            if isinstance(result, Exception):
+                lease = None
+                result = self.name_service.register(otype, address)
+        self.invalidate_type(otype)
+        if lease is not None and not isinstance(result, Exception):
+            self._keep(result[0], otype, result[1],
+                       (lease, load, address, moved))
+        return result
+
+    def unregister(self, oid, otype, ohash):
+        """Unregister an object from the name service."""
+        self.lock.acquire()
+        try:
+            self.leases.pop((oid, otype), None)
+        finally:
+            self.lock.release()
+        result = self.name_service.unregister(oid, otype, ohash)
+        self.invalidate_type(otype)
+        return result
+
+    def invalidate(self, address):
+        """Drop the cached entries holding an address."""
+        address = cache_key(address)
+        self.lock.acquire()
+        try:
+            for key in self.holders.pop(address, ()):
+                if isinstance(key, tuple):
+                    self._drop(self.objects, key)
+                else:
+                    self._drop(self.types, key)
+        finally:
+            self.lock.release()
+
+    def invalidate_type(self, otype):
+        """Drop the cached objects of a type."""
+        self.lock.acquire()
+        try:
+            self._drop(self.types, otype)
+            for key in [key for key in self.objects if key[0] == otype]:
+                self._drop(self.objects, key)
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """Stop watching the stubs' failures and renewing the leases."""
+        if self.call_failed in orb.failure_hooks:
+            orb.failure_hooks.remove(self.call_failed)
+        self.lock.acquire()
+        try:
+            self.closed = True
+            self.renewed.notify_all()
+        finally:
+            self.lock.release()
+
+    def call_failed(self, address, request, error):
+        """Drop the cached entries of an address that a call failed to
+        reach (see orb.failure_hooks)."""
+        if not isinstance(error, orb.ServerBusy):
+            self.invalidate(address)
+
+    def __getattr__(self, attr):
+        """Calls of other methods of the name service are forwarded."""
+        if attr.startswith("_"):
+            raise AttributeError(
+                "NameCache instance has no attribute '{0}'".format(attr))
+        return getattr(self.name_service, attr)
+
+    # Private methods
+
+    def _keep(self, oid, otype, ohash, registration):
+        """Renew a lease in the background.
+
+        registration is (lease, load, address, moved), see register.
+
+        """
+        self.lock.acquire()
+        try:
+            self.leases[(oid, otype)] = (ohash,) + registration
+            if self.renewer is None:
+                self.renewer = threading.Thread(target=self._renew)
+                self.renewer.daemon = True
+                self.renewer.start()
+            self.renewed.notify_all()
+        finally:
+            self.lock.release()
+
+    def _renew(self):
+        """Renew all the leases, every third of the shortest one.
+
+        The renewals are more frequent, every REPORT_INTERVAL, when they
+        carry loads.
+
+        """
+        while True:
+            self.lock.acquire()
+            try:
+                while not self.closed and not self.leases:
+                    self.renewed.wait()
+                if self.closed:
+                    return
+                period = min(entry[1] for entry in self.leases.values()) / 3
+                if any(entry[2] is not None
+                       for entry in self.leases.values()):
+                    period = min(period, REPORT_INTERVAL)
+                deadline = time.monotonic() + period
+                while not self.closed and time.monotonic() < deadline:
+                    self.renewed.wait(deadline - time.monotonic())
+                if self.closed:
+                    return
+                leases = {}
+                for (oid, otype), entry in self.leases.items():
+                    ohash, lease, load = entry[:3]
+                    leases.setdefault(lease, []).append(
+                        (oid, otype, ohash, load))
+            finally:
+                self.lock.release()
+            for lease, batch in leases.items():
+                batch = [[oid, otype, ohash] + ([] if load is None
+                                                else [load()])
+                         for oid, otype, ohash, load in batch]
+                lost = self.name_service.renew(batch, lease)
+                if isinstance(lost, Exception):
+                    # Try again next time, the lease may still be valid.
+                    continue
+                for oid, otype in lost:
+                    self._register_again(oid, otype)
+
+    def _register_again(self, oid, otype):
+        """Register again an object whose lease was lost.
+
+        If the name service cannot be reached, the lease is kept, to be
+        lost again and retried with the next renewal.
+
+        """
+        self.lock.acquire()
+        try:
+            entry = self.leases.get((oid, otype))
+        finally:
+            self.lock.release()
+        if entry is None:
+            # Unregistered meanwhile.
+            return
+        lease, load, address, moved = entry[1:]
+        result = self.name_service.register(otype, address, lease)
+        if isinstance(result, Exception):
+            return
+        new_id, new_hash = result
+        self.invalidate_type(otype)
+        self.lock.acquire()
+        try:
+            kept = self.leases.pop((oid, otype), None) is not None
+        finally:
+            self.lock.release()
+        if not kept:
+            # Unregistered meanwhile: drop the new registration too.
+            self.name_service.unregister(new_id, otype, new_hash)
+            return
+        self._keep(new_id, otype, new_hash, entry[1:])
+        if moved is not None:
+            moved(new_id, new_hash)
+
+    def _objects(self, otype):
+        """Return the (id, address) pairs of a type, cached if possible."""
+        now = time.monotonic()
+        self.lock.acquire()
+        try:
+            entry = self.types.get(otype)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+        finally:
+            self.lock.release()
+        objects = self.name_service.require_all(otype)
+        if isinstance(objects, Exception):
+            return objects
+        objects = [(oid, cache_key(address)) for oid, address in objects]
+        self._store(self.types, otype, objects,
+                    [address for _, address in objects])
+        return objects
+
+    def _store(self, cache, key, value, addresses):
+        self.lock.acquire()
+        try:
+            self._drop(cache, key)
+            cache[key] = (time.monotonic() + self.ttl, value)
+            for address in addresses:
+                self.holders.setdefault(cache_key(address), set()).add(key)
+        finally:
+            self.lock.release()
+
+    def _drop(self, cache, key):
+        """Remove a cached entry, the lock being held."""
+        entry = cache.pop(key, None)
+        if entry is None:
+            return
+        value = entry[1]
+        addresses = ([value] if isinstance(key, tuple)
+                     else [address for _, address in value])
+        for address in addresses:
+            keys = self.holders.get(address)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.holders[address]
+
+
+def cache_key(address):
+    """Return an address in a hashable form: a (host, port) tuple, or
+    the path of a Unix socket."""
+    return address if isinstance(address, str) else tuple(address)
+
+
+def plain_address(key):
+    """Return an address as the name service returns it."""
+    return key if isinstance(key, str) else list(key)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def name_service(address):
+    """Return the NameCache of address shared by the whole process."""
+    address = cache_key(address)
+    _caches_lock.acquire()
+    try:
+        cache = _caches.get(address)
+        if cache is None:
+            cache = _caches[address] = NameCache(address)
+        return cache
+    finally:
+        _caches_lock.release()
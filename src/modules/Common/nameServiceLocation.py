@@ -12,6 +12,16 @@
 This module's role is simply to allow easy maintenance of the lab
 structure if the name service changes address.
 
+The address can be overridden with the environment variable
+TDDD25_NAME_SERVICE, as "host:port", to use a local name service (see
+nameService/nameServer.py).
+
 """
 
+import os
+
 name_service_address = ("ns-tddd25.edu.liu.se", 42424)
+
+if os.environ.get("TDDD25_NAME_SERVICE"):
+    _host, _port = os.environ["TDDD25_NAME_SERVICE"].rsplit(":", 1)
+    name_service_address = (_host, int(_port))
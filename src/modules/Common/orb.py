@@ -9,67 +9,1680 @@
 
 import threading
 import socket
+import collections
+import collections.abc
+import inspect
+import itertools
 import json
+import os
+import queue
+import struct
+import tempfile
+import time
+import zlib
+from concurrent.futures import Future, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from . import metrics
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 """Object Request Broker
 
-This module implements the infrastructure needed to transparently create
-objects that communicate via networks. This infrastructure consists of:
+This module implements the infrastructure needed to transparently create
+objects that communicate via networks. This infrastructure consists of:
+
+--  Strub ::
+        Represents the image of a remote object on the local machine.
+        Used to connect to remote objects. Also called Proxy.
+--  Skeleton ::
+        Used to listen to incoming connections and forward them to the
+        main object.
+--  Peer ::
+        Class that implements basic bidirectional (Stub/Skeleton)
+        communication. Any object wishing to transparently interact with
+        remote objects should extend this class.
+
+"""
+
+
+class CommunicationError(Exception):
+    pass
+
+
+class ServerBusy(CommunicationError):
+    pass
+
+
+class DeadlineExceeded(CommunicationError):
+    pass
+
+
+# -----------------------------------------------------------------------------
+# Deadlines
+# -----------------------------------------------------------------------------
+
+# A request may carry a "deadline": the number of seconds the caller is
+# still willing to wait for it. The skeleton turns it into a local
+# time.monotonic() deadline when the request arrives, drops the request
+# if the deadline passes before it runs, and makes it the deadline of
+# the serving thread, so that nested calls inherit the remaining budget.
+
+_context = threading.local()
+
+
+def current_deadline():
+    """Return the deadline (time.monotonic()) of the current thread."""
+    return getattr(_context, "deadline", None)
+
+
+class deadline(object):
+
+    """Context manager bounding all calls made in its block.
+
+        with orb.deadline(2.0):
+            stub.read()
+            other_stub.write(fortune)
+
+    A deadline never extends the one already in effect.
+
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = current_deadline()
+        _context.deadline = min_deadline(
+            self.previous, time.monotonic() + self.seconds)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _context.deadline = self.previous
+        return False
+
+
+def min_deadline(first, second):
+    """Return the earliest of two deadlines, either of which may be None."""
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return min(first, second)
+
+
+def request_deadline(request):
+    """Return the local deadline of a request that has just arrived."""
+    if request.get('deadline') is None:
+        return None
+    return time.monotonic() + request['deadline']
+
+
+# Executors of remote methods: POOL runs the method on the skeleton's
+# worker threads, INLINE runs it directly on the thread (or event loop)
+# reading the connection, which suits short, non-blocking methods.
+POOL = "pool"
+INLINE = "inline"
+
+
+class RemoteMethod(object):
+
+    """Declaration of a method that may be called over the network.
+
+    oneway methods are acknowledged as soon as the call is accepted,
+    before they run, so callers never wait for them. executor is POOL
+    or INLINE.
+
+    """
+
+    def __init__(self, oneway=False, executor=POOL):
+        self.oneway = oneway
+        self.executor = executor
+
+
+def remote(function=None, oneway=False, executor=POOL):
+    """Decorator exporting a method of an owner class.
+
+    Used either as @remote or as @remote(oneway=True, ...).
+
+    """
+    declaration = RemoteMethod(oneway, executor)
+
+    def export(function):
+        function.remote_method = declaration
+        return function
+
+    if function is not None:
+        return export(function)
+    return export
+
+
+class Export(object):
+
+    """Entry of a dispatch table: a bound method and its declaration."""
+
+    def __init__(self, name, function, declaration):
+        self.name = name
+        self.function = function
+        self.oneway = declaration.oneway
+        self.executor = declaration.executor
+        self.min_args, self.max_args = self._arity(function)
+
+    def __call__(self, args):
+        """Call the method, checking the number of arguments first."""
+        if len(args) < self.min_args or (self.max_args is not None and
+                                         len(args) > self.max_args):
+            raise TypeError("{}() called with {} arguments".format(
+                self.name, len(args)))
+        return self.function(*args)
+
+    # Private methods
+
+    def _arity(self, function):
+        """Return the minimum and maximum (None if any) number of args."""
+        try:
+            parameters = inspect.signature(function).parameters.values()
+        except (TypeError, ValueError):
+            return 0, None
+        positional = [p for p in parameters if p.kind in
+                      (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+        required = [p for p in positional if p.default is p.empty]
+        if any(p.kind == p.VAR_POSITIONAL for p in parameters):
+            return len(required), None
+        return len(required), len(positional)
+
+
+class Dispatcher(object):
+
+    """Dispatch table of the remote methods of an owner object.
+
+    The remote interface of an owner is made of the methods of its
+    class marked with @remote, plus the names listed in the class
+    attribute remote_methods (a sequence of names, or a dictionary of
+    names to RemoteMethod declarations) for methods reached through
+    delegation, e.g. a __getattr__. The table is built once, when the
+    skeleton starts, so the owner must be fully initialized by then.
+
+    Owners that declare no remote interface at all export their public
+    attributes, looked up on first use.
+
+    The dispatcher also runs the skeleton's interceptors (see
+    Interceptor), default_interceptors if none are given.
+
+    """
+
+    def __init__(self, owner, interceptors=None):
+        self.owner = owner
+        self.interceptors = (interceptors if interceptors is not None
+                             else default_interceptors)
+        self.table = {}
+        self.declared = False
+        for cls in reversed(type(owner).__mro__):
+            for name, attr in vars(cls).items():
+                declaration = getattr(attr, "remote_method", None)
+                if isinstance(declaration, RemoteMethod):
+                    self._export(name, declaration)
+            declared = vars(cls).get("remote_methods", ())
+            for name in declared:
+                if isinstance(declared, dict):
+                    self._export(name, declared[name])
+                else:
+                    self._export(name, RemoteMethod())
+
+    # Public methods
+
+    def lookup(self, name):
+        """Return the Export of a remote method, or raise AttributeError."""
+        try:
+            return self.table[name]
+        except (KeyError, TypeError):
+            pass
+        if (self.declared or not isinstance(name, str) or
+                name.startswith("_") or not hasattr(self.owner, name)):
+            raise AttributeError("No remote method '{}'".format(name))
+        return self._export(name, RemoteMethod(), declare=False)
+
+    def accept(self, request):
+        """Run the interceptors on a new request, then admit it."""
+        if self.interceptors:
+            for interceptor in self.interceptors:
+                interceptor.receive_request(self.owner, request)
+        return self.admit(request)
+
+    def respond(self, request, response):
+        """Run the interceptors on a response, return the response."""
+        if self.interceptors:
+            try:
+                for interceptor in reversed(self.interceptors):
+                    interceptor.send_response(self.owner, request, response)
+            except Exception as e:
+                return error_response(e)
+        return response
+
+    def admit(self, request):
+        """Check a request before any work is done for it.
+
+        Return the Export the request calls, or None for a batch, and
+        raise if the request is malformed or calls an unknown method.
+
+        """
+        if 'batch' in request:
+            return None
+        if 'method' not in request or 'args' not in request:
+            raise CommunicationError("Malformed request")
+        return self.lookup(request['method'])
+
+    def stats(self, request):
+        """Return the server-side MethodStats of an admitted request."""
+        name = call_name(request)
+        if name == "batch" or name in self.table:
+            return metrics.server.method(name)
+        return None
+
+    def process(self, request, deadline=None):
+        """Run one decoded request on the owner and build its response.
+
+        A batch request carries a list of requests under "batch"; they
+        are run in order and the response holds the list of their
+        responses. Requests whose deadline has passed are not run.
+
+        """
+        stats = self.stats(request)
+        if stats is None:
+            return self._process(request, deadline)
+        stats.start()
+        start = time.monotonic()
+        response = self._process(request, deadline)
+        stats.finish(time.monotonic() - start, 'error' in response)
+        return response
+
+    def submit(self, request, run):
+        """Serve a request made from this process, without a connection.
+
+        run(function, *args) runs function on the skeleton's workers and
+        returns its future, or None when they are all busy. Return the
+        future of the response, or None for one-way requests. Nothing is
+        encoded: the owner gets the caller's arguments as they are.
+
+        """
+        future = Future()
+        future.connection = None
+        oneway = request.get('oneway')
+        deadline = request_deadline(request)
+        try:
+            export = self.accept(request)
+        except Exception as e:
+            future.set_result(self.respond(request, error_response(e)))
+            return None if oneway else future
+        if export is not None and export.oneway and not oneway:
+            # Acknowledge declared one-way methods at once.
+            future.set_result(self.respond(request, {"result": None}))
+            request = dict(request, oneway=True)
+        if export is not None and export.executor == INLINE:
+            served = Future()
+            served.set_result(self.process(request, deadline))
+        else:
+            served = run(self.process, request, deadline)
+        if oneway:
+            return None
+        if not future.done():
+            if served is None:
+                future.set_result(self.respond(
+                    request, busy_response("Request queue full")))
+            else:
+                served.add_done_callback(
+                    lambda served: future.set_result(
+                        self.respond(request, served.result())))
+        return future
+
+    # Private methods
+
+    def _process(self, request, deadline):
+        if deadline is not None and time.monotonic() >= deadline:
+            return error_response(DeadlineExceeded(
+                "Deadline passed before the call could run"))
+        if 'batch' in request:
+            return {"result": [self._process(call, deadline)
+                               for call in request['batch']]}
+        previous = current_deadline()
+        _context.deadline = deadline
+        try:
+            result = self.admit(request)(request['args'] or ())
+            if (isinstance(result, collections.abc.Iterator) and
+                    not request.get('stream')):
+                # Callers that do not stream get the whole result.
+                result = list(result)
+            return {"result": result}
+        except Exception as e:
+            return error_response(e)
+        finally:
+            _context.deadline = previous
+
+    def _export(self, name, declaration, declare=True):
+        self.declared = self.declared or declare
+        export = Export(name, getattr(self.owner, name), declaration)
+        self.table[name] = export
+        return export
+
+
+# Errors of the ORB itself, rebuilt as their own class rather than as a
+# new one so that callers can handle them (e.g. except orb.ServerBusy).
+orb_errors = {error.__name__: error for error in
+              (CommunicationError, ServerBusy, DeadlineExceeded)}
+
+
+def response_error(data):
+    """Rebuild the exception carried by an error response."""
+    name = data["error"]["name"]
+    exception = orb_errors.get(name)
+    if exception is None:
+        exception = type(name, (Exception,), dict())
+    return exception(*data["error"]["args"])
+
+
+def unpack_response(data):
+    """Return the result carried by a response, or raise its error."""
+    if not data:
+        raise(Exception('No data received'))
+    if 'error' in data:
+        raise response_error(data)
+    if 'result' in data:
+        return data['result']
+    else:
+        print('Wrong format on server response')
+
+
+def call_name(request):
+    """Return the name under which the metrics of a request are kept."""
+    return "batch" if 'batch' in request else request.get('method')
+
+
+def error_response(e):
+    """Build the response reporting the exception e to the caller."""
+    return {"error": {"name": type(e).__name__,
+                      "args": [str(arg) for arg in e.args]}}
+
+
+# -----------------------------------------------------------------------------
+# Interceptors
+# -----------------------------------------------------------------------------
+
+
+class Interceptor(object):
+
+    """Hook into the requests and responses of stubs and skeletons.
+
+    Stubs call send_request before a request is encoded and
+    receive_response after its response is decoded, or call_failed
+    when the request could not be sent or its response never came (the
+    error is an OSError or a CommunicationError); skeletons call
+    receive_request after a request is decoded and send_response before
+    its response is encoded. Interceptors run in order on requests and
+    in reverse order on responses.
+
+    The hooks may modify the message in place, for instance to attach
+    metadata (trace ids, timings, ...) under its "meta" dictionary,
+    which travels with the message. An exception raised by
+    receive_request rejects the call, with that exception as its error.
+    The default hooks do nothing.
+
+    """
+
+    def send_request(self, address, request):
+        pass
+
+    def receive_response(self, address, request, response):
+        pass
+
+    def call_failed(self, address, request, error):
+        pass
+
+    def receive_request(self, owner, request):
+        pass
+
+    def send_response(self, owner, request, response):
+        pass
+
+
+# Interceptors of the stubs and skeletons created without their own list.
+default_interceptors = []
+
+# Functions called as hook(address, request, error) when a call of any
+# stub fails like in Interceptor.call_failed, whatever its interceptors.
+# Skeletons never call them.
+failure_hooks = []
+
+
+# -----------------------------------------------------------------------------
+# Codecs
+# -----------------------------------------------------------------------------
+
+
+class Codec(object):
+
+    """Serialization format of the messages sent on a connection.
+
+    Subclasses set name, the identifier used during negotiation, and
+    implement encode (message to bytes) and decode (bytes-like object
+    to message).
+
+    """
+
+    name = None
+
+    def encode(self, message):
+        raise NotImplementedError
+
+    def decode(self, data):
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+
+    """JSON text, understood by every peer.
+
+    Dictionary keys always come back as strings.
+
+    """
+
+    name = "json"
+
+    def encode(self, message):
+        return json.dumps(message).encode()
+
+    def decode(self, data):
+        return json.loads(bytes(data))
+
+
+class StructCodec(Codec):
+
+    """Compact tagged binary format built on the struct module.
+
+    Every value starts with a one byte tag. Strings, bytes, lists and
+    dictionaries are prefixed with their length, so payloads are copied
+    as they are and dictionaries keep keys of any type.
+
+    """
+
+    name = "struct"
+
+    INT = struct.Struct("!q")
+    FLOAT = struct.Struct("!d")
+    SIZE = struct.Struct("!I")
+
+    def encode(self, message):
+        out = bytearray()
+        self._encode(message, out)
+        return bytes(out)
+
+    def decode(self, data):
+        value, _ = self._decode(memoryview(data), 0)
+        return value
+
+    # Private methods
+
+    def _encode(self, value, out):
+        if value is None:
+            out += b"N"
+        elif value is True:
+            out += b"T"
+        elif value is False:
+            out += b"F"
+        elif isinstance(value, int):
+            if -2**63 <= value < 2**63:
+                out += b"i"
+                out += self.INT.pack(value)
+            else:
+                self._encode_sized(b"I", str(value).encode(), out)
+        elif isinstance(value, float):
+            out += b"d"
+            out += self.FLOAT.pack(value)
+        elif isinstance(value, str):
+            self._encode_sized(b"s", value.encode(), out)
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            self._encode_sized(b"b", value, out)
+        elif isinstance(value, (list, tuple)):
+            out += b"l"
+            out += self.SIZE.pack(len(value))
+            for item in value:
+                self._encode(item, out)
+        elif isinstance(value, dict):
+            out += b"m"
+            out += self.SIZE.pack(len(value))
+            for key, item in value.items():
+                self._encode(key, out)
+                self._encode(item, out)
+        else:
+            raise TypeError("Object of type {} cannot be encoded".format(
+                type(value).__name__))
+
+    def _encode_sized(self, tag, data, out):
+        out += tag
+        out += self.SIZE.pack(len(data))
+        out += data
+
+    def _decode(self, data, offset):
+        tag = data[offset:offset + 1].tobytes()
+        offset += 1
+        if tag == b"N":
+            return None, offset
+        elif tag == b"T":
+            return True, offset
+        elif tag == b"F":
+            return False, offset
+        elif tag == b"i":
+            return self.INT.unpack_from(data, offset)[0], offset + 8
+        elif tag == b"d":
+            return self.FLOAT.unpack_from(data, offset)[0], offset + 8
+        size = self.SIZE.unpack_from(data, offset)[0]
+        offset += 4
+        if tag == b"s":
+            return str(data[offset:offset + size], "utf-8"), offset + size
+        elif tag == b"b":
+            return data[offset:offset + size].tobytes(), offset + size
+        elif tag == b"I":
+            return int(data[offset:offset + size].tobytes()), offset + size
+        elif tag == b"l":
+            items = []
+            for _ in range(size):
+                item, offset = self._decode(data, offset)
+                items.append(item)
+            return items, offset
+        elif tag == b"m":
+            items = {}
+            for _ in range(size):
+                key, offset = self._decode(data, offset)
+                items[key], offset = self._decode(data, offset)
+            return items, offset
+        raise ValueError("Unknown tag {!r} in message".format(tag))
+
+
+class MsgpackCodec(Codec):
+
+    """MessagePack, used when the msgpack package is installed."""
+
+    name = "msgpack"
+
+    def encode(self, message):
+        return msgpack.packb(message, use_bin_type=True)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+# Supported codecs, by order of preference.
+codecs = collections.OrderedDict(
+    (codec.name, codec) for codec in
+    ([MsgpackCodec()] if msgpack is not None else []) +
+    [StructCodec(), JsonCodec()])
+
+
+class Compressor(object):
+
+    """Compression of the large messages sent on a connection.
+
+    Subclasses set name, the identifier used during negotiation, and
+    implement compress and decompress (bytes-like object to bytes).
+
+    """
+
+    name = None
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    def decompress(self, data):
+        raise NotImplementedError
+
+
+class ZlibCompressor(Compressor):
+
+    """zlib at its fastest level, always available."""
+
+    name = "zlib"
+
+    def compress(self, data):
+        return zlib.compress(data, 1)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class Lz4Compressor(Compressor):
+
+    """LZ4 frames, used when the lz4 package is installed."""
+
+    name = "lz4"
+
+    def compress(self, data):
+        return lz4.frame.compress(data)
+
+    def decompress(self, data):
+        return lz4.frame.decompress(data)
+
+
+class ZstdCompressor(Compressor):
+
+    """Zstandard, used when the zstandard package is installed."""
+
+    name = "zstd"
+
+    def compress(self, data):
+        # zstandard (de)compressors must not be shared between threads.
+        return zstandard.ZstdCompressor(level=3).compress(data)
+
+    def decompress(self, data):
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+# Supported compressors, by order of preference.
+compressors = collections.OrderedDict(
+    (compressor.name, compressor) for compressor in
+    ([ZstdCompressor()] if zstandard is not None else []) +
+    ([Lz4Compressor()] if lz4 is not None else []) +
+    [ZlibCompressor()])
+
+# Opening bytes of a connection using framed messages. Connections that
+# start with anything else carry one JSON document per line.
+MAGIC = b"ORB1"
+
+# Header of a frame: the length of the encoded message that follows.
+FRAME = struct.Struct("!I")
+
+# Bit of the frame header set when the message is compressed.
+COMPRESSED = 0x80000000
+
+# Encoded messages smaller than this, in bytes, are never compressed.
+COMPRESS_THRESHOLD = 4096
+
+
+def encode_offer(names, compressions=()):
+    """Build the opening of a framed connection.
+
+    The offer lists the codec names, then, after a ';', the names of
+    the compressors the caller accepts.
+
+    """
+    offer = ",".join(names)
+    if compressions:
+        offer += ";" + ",".join(compressions)
+    offer = offer.encode()
+    return MAGIC + bytes([len(offer)]) + offer
+
+
+def choose_codec(offer):
+    """Return the first codec of an offer (bytes) that we support."""
+    for name in offer.decode().partition(";")[0].split(","):
+        if name in codecs:
+            return codecs[name]
+    raise CommunicationError("No supported codec in offer {!r}".format(offer))
+
+
+def choose_compressor(offer):
+    """Return the first compressor of an offer that we support, or None."""
+    for name in offer.decode().partition(";")[2].split(","):
+        if name in compressors:
+            return compressors[name]
+    return None
+
+
+def encode_answer(codec, compressor=None):
+    """Build the skeleton's answer naming the codec it has chosen."""
+    answer = codec.name
+    if compressor is not None:
+        answer += ";" + compressor.name
+    answer = answer.encode()
+    return MAGIC + bytes([len(answer)]) + answer
+
+
+def decode_answer(answer):
+    """Return the codec and compressor named by a skeleton's answer."""
+    name, _, compression = answer.decode().partition(";")
+    if name not in codecs:
+        raise CommunicationError("Unknown codec '{}'".format(name))
+    if compression and compression not in compressors:
+        raise CommunicationError(
+            "Unknown compressor '{}'".format(compression))
+    return codecs[name], compressors.get(compression)
+
+
+def encode_frame(data, compressor=None):
+    """Build the frame of an encoded message, as a (header, payload) pair.
+
+    With a compressor, messages of at least COMPRESS_THRESHOLD bytes are
+    compressed, unless that does not make them any smaller.
+
+    """
+    if compressor is not None and len(data) >= COMPRESS_THRESHOLD:
+        packed = compressor.compress(data)
+        if len(packed) < len(data):
+            metrics.compression.compressed(compressor.name, len(data),
+                                           len(packed))
+            return FRAME.pack(len(packed) | COMPRESSED), packed
+    return FRAME.pack(len(data)), data
+
+
+def decode_header(header):
+    """Return the size of a frame's message and whether it is compressed."""
+    size, = FRAME.unpack_from(header)
+    return size & ~COMPRESSED, bool(size & COMPRESSED)
+
+
+def decode_payload(data, compressed, compressor):
+    """Return the encoded message carried by a frame."""
+    if not compressed:
+        return data
+    if compressor is None:
+        raise CommunicationError("Compressed frame on uncompressed connection")
+    raw = compressor.decompress(data)
+    metrics.compression.decompressed(compressor.name, len(raw), len(data))
+    return raw
+
+
+class LineTransport(object):
+
+    """Messages as JSON documents, one per line.
+
+    This is the original format of the lab protocol, still spoken by
+    callers that do not open the connection with MAGIC.
+
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile(mode="rb")
+        self.lock = threading.Lock()
+        self.last_size = 0
+
+    def receive(self):
+        """Return the next message, or None once the connection is closed.
+
+        The size of the message, in bytes, is left in last_size.
+
+        """
+        line = self.reader.readline()
+        if not line:
+            return None
+        self.last_size = len(line)
+        return json.loads(line)
+
+    def send(self, message):
+        """Send a message, return its size in bytes."""
+        data = json.dumps(message).encode() + b"\n"
+        self.lock.acquire()
+        try:
+            self.sock.sendall(data)
+        finally:
+            self.lock.release()
+        return len(data)
+
+
+class FrameTransport(object):
+
+    """Messages encoded by a codec, each prefixed with its length.
+
+    Large messages are compressed if a compressor has been negotiated.
+
+    Incoming bytes are read with recv_into into a buffer that is reused
+    from one message to the next, and messages are decoded straight
+    from a view of it. Only one thread may receive. The header and the
+    payload of outgoing frames are sent together with sendmsg, without
+    joining them first.
+
+    """
+
+    # Initial size of the receive buffer, in bytes.
+    BUFFER_SIZE = 64 * 1024
+    # Larger buffers, grown for large messages, are dropped once empty.
+    MAX_KEPT_BUFFER = 1024 * 1024
+
+    def __init__(self, sock, codec, compressor=None):
+        self.sock = sock
+        self.codec = codec
+        self.compressor = compressor
+        self.lock = threading.Lock()
+        self.last_size = 0
+        self.buffer = bytearray(self.BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        # The bytes received but not consumed yet are view[start:end].
+        self.start = 0
+        self.end = 0
+
+    def receive(self):
+        """Return the next message, or None once the connection is closed.
+
+        The size of the frame, in bytes, is left in last_size.
+
+        """
+        if not self._fill(FRAME.size):
+            return None
+        size, compressed = decode_header(self.view[self.start:])
+        self.start += FRAME.size
+        if not self._fill(size):
+            return None
+        data = self.view[self.start:self.start + size]
+        self.start += size
+        self.last_size = FRAME.size + size
+        message = self.codec.decode(
+            decode_payload(data, compressed, self.compressor))
+        if self.start == self.end:
+            self.start = self.end = 0
+            if len(self.buffer) > self.MAX_KEPT_BUFFER:
+                self._resize(self.BUFFER_SIZE)
+        return message
+
+    def send(self, message):
+        """Send a message, return the size of its frame in bytes."""
+        header, payload = encode_frame(self.codec.encode(message),
+                                       self.compressor)
+        size = len(header) + len(payload)
+        self.lock.acquire()
+        try:
+            if hasattr(self.sock, "sendmsg"):
+                sent = self.sock.sendmsg((header, payload))
+            else:
+                sent = 0
+            if sent < size:
+                # Partial write (or no sendmsg): send the rest as usual.
+                self.sock.sendall(memoryview(header + payload)[sent:])
+        finally:
+            self.lock.release()
+        return size
+
+    # Private methods
+
+    def _fill(self, size):
+        """Receive until size bytes are available, False on end of stream."""
+        if self.end - self.start >= size:
+            return True
+        if self.start + size > len(self.buffer):
+            if size > len(self.buffer):
+                self._resize(max(size, 2 * len(self.buffer)))
+            else:
+                # Move the pending bytes to the front of the buffer.
+                pending = self.end - self.start
+                self.view[:pending] = self.view[self.start:self.end]
+                self.start, self.end = 0, pending
+        while self.end - self.start < size:
+            received = self.sock.recv_into(self.view[self.end:])
+            if received == 0:
+                return False
+            self.end += received
+        return True
+
+    def _resize(self, length):
+        """Replace the buffer by one of length bytes, keeping pending bytes."""
+        buffer = bytearray(length)
+        pending = self.end - self.start
+        buffer[:pending] = self.view[self.start:self.end]
+        self.buffer, self.view = buffer, memoryview(buffer)
+        self.start, self.end = 0, pending
+
+
+def client_transport(sock, names=None, compressions=None):
+    """Negotiate the codec of a new outgoing connection.
+
+    names lists the codecs the caller is willing to use, by order of
+    preference; it defaults to every supported codec. compressions
+    lists the compressors likewise; an empty list disables compression.
+
+    """
+    if compressions is None:
+        compressions = list(compressors)
+    sock.sendall(encode_offer(names or list(codecs), compressions))
+    answer = receive_exactly(sock, len(MAGIC) + 1)
+    if len(answer) < len(MAGIC) + 1 or not answer.startswith(MAGIC):
+        raise CommunicationError("Unexpected answer to codec negotiation")
+    codec, compressor = decode_answer(receive_exactly(sock, answer[-1]))
+    return FrameTransport(sock, codec, compressor)
+
+
+def server_transport(sock):
+    """Return the transport for a new incoming connection.
+
+    Callers that open the connection with MAGIC negotiate a codec and
+    use framed messages; all others are served JSON lines.
+
+    """
+    if sock.recv(1, socket.MSG_PEEK) != MAGIC[:1]:
+        return LineTransport(sock)
+    opening = receive_exactly(sock, len(MAGIC) + 1)
+    if len(opening) < len(MAGIC) + 1 or not opening.startswith(MAGIC):
+        raise CommunicationError("Malformed connection opening")
+    offer = receive_exactly(sock, opening[-1])
+    codec, compressor = choose_codec(offer), choose_compressor(offer)
+    sock.sendall(encode_answer(codec, compressor))
+    return FrameTransport(sock, codec, compressor)
+
+
+def receive_exactly(sock, size):
+    """Receive size bytes from sock, fewer only if it gets closed.
+
+    Nothing beyond size bytes is read, so the transport that takes over
+    the socket misses nothing.
+
+    """
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            break
+        received += count
+    return bytes(data[:received])
+
+
+# -----------------------------------------------------------------------------
+# Same host
+# -----------------------------------------------------------------------------
+
+# Skeletons also listen on a Unix domain socket, at a path derived from
+# their TCP port, so that callers on the same host skip the TCP stack.
+# Stubs can also be given the path of a Unix domain socket as address.
+# Skeletons running in this process are also listed in local_skeletons,
+# by port, and stubs of their address dispatch calls to them directly,
+# without serializing anything.
+
+local_skeletons = {}
+
+_local_hosts = None
+
+
+def unix_path(port):
+    """Return the path of the Unix domain socket of a TCP port."""
+    return os.path.join(tempfile.gettempdir(), "orb-{}.sock".format(port))
+
+
+def is_local_host(host):
+    """Return True if host names this machine."""
+    global _local_hosts
+    if _local_hosts is None:
+        hosts = {"", "localhost", "::1", socket.gethostname()}
+        try:
+            hosts.add(socket.gethostbyname(socket.gethostname()))
+        except OSError:
+            pass
+        _local_hosts = hosts
+    return host in _local_hosts or host.startswith("127.")
+
+
+def local_skeleton(address):
+    """Return the skeleton of this process serving address, or None."""
+    if isinstance(address, str):
+        return None
+    skeleton = local_skeletons.get(address[1])
+    if skeleton is None or not is_local_host(address[0]):
+        return None
+    return skeleton
+
+
+def connect(address, timeout=None):
+    """Open a connection to address, by Unix domain socket if possible."""
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+    if hasattr(socket, "AF_UNIX") and is_local_host(address[0]):
+        path = unix_path(address[1])
+        if os.path.exists(path):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(timeout)
+                sock.connect(path)
+                return sock
+            except OSError:
+                # Stale socket file: fall back to TCP.
+                sock.close()
+    sock = socket.create_connection(address, timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+# -----------------------------------------------------------------------------
+# Client side
+# -----------------------------------------------------------------------------
+
+
+# Chunks a stream may send ahead of the items consumed by the caller.
+STREAM_WINDOW = 8
+
+
+class Stream(object):
+
+    """Lazy iterator over the items streamed back by a remote method.
+
+    The skeleton sends the items in chunks, one chunk per credit. The
+    stream grants one credit for every chunk it receives, so no more
+    than STREAM_WINDOW chunks are ever buffered, however long the
+    result. A remote method that returns a list instead has its items
+    iterated. Each chunk is waited for at most timeout seconds, and
+    close() cancels the rest of the stream.
+
+    The connection hands the stream its messages like it resolves the
+    futures of other requests, through set_result and set_exception.
+    Once the stream is over, ended is called with what ended it: the
+    last message, an exception, or None when the stream was closed.
+
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.messages = queue.Queue()
+        self.items = collections.deque()
+        self.done = False
+        self.connection = None
+        self.request_id = None
+        self.method = None
+        self.ended = None
+
+    # Public methods
+
+    def set_result(self, message):
+        self.messages.put(message)
+
+    def set_exception(self, exception):
+        self.messages.put(exception)
+
+    def close(self):
+        """Cancel the stream, dropping the items not received yet."""
+        if not self.done:
+            self._end(None)
+            self.connection.cancel(self.request_id)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self.items:
+            if self.done:
+                raise StopIteration
+            try:
+                message = self.messages.get(timeout=self.timeout)
+            except queue.Empty:
+                error = DeadlineExceeded("No chunk from {} in time".format(
+                    self.connection.address))
+                self._end(error)
+                self.connection.cancel(self.request_id)
+                raise error
+            if isinstance(message, Exception):
+                self._end(message)
+                raise message
+            if "chunk" in message:
+                self.connection.grant(self.request_id, 1)
+                self.items.extend(message["chunk"])
+            else:
+                self._end(message)
+                self.items.extend(unpack_response(message) or ())
+        return self.items.popleft()
+
+    # Private methods
+
+    def _end(self, outcome):
+        self.done = True
+        if self.ended is not None:
+            self.ended(outcome)
+
+
+class Connection(object):
+
+    """A long-lived, multiplexed connection to a remote skeleton.
+
+    The codec of the connection, and the compressor of its large
+    messages, are negotiated when it is opened. Every
+    request sent on the connection carries an "id" that the skeleton
+    copies into its response. Many threads can thus send requests
+    back-to-back on the same connection; a reader thread matches the
+    responses, which may arrive out of order, to the futures of the
+    waiting callers. Streaming requests get a Stream instead.
+
+    """
+
+    def __init__(self, address, codecs=None, connect_timeout=None,
+                 compressions=None):
+        self.address = address
+        self.sock = connect(address, connect_timeout)
+        try:
+            self.transport = client_transport(self.sock, codecs,
+                                              compressions)
+            self.sock.settimeout(None)
+        except Exception:
+            self.sock.close()
+            raise
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.pending = {}
+        self.closed = False
+        self.error = None
+        self.last_used = time.monotonic()
+        self.calls = 0
+        receiver = threading.Thread(target=self._receive)
+        receiver.daemon = True
+        receiver.start()
+
+    # Public methods
 
---  Strub ::
-        Represents the image of a remote object on the local machine.
-        Used to connect to remote objects. Also called Proxy.
---  Skeleton ::
-        Used to listen to incoming connections and forward them to the
-        main object.
---  Peer ::
-        Class that implements basic bidirectional (Stub/Skeleton)
-        communication. Any object wishing to transparently interact with
-        remote objects should extend this class.
+    def in_flight(self):
+        """Return the number of requests still waiting for a response."""
+        return len(self.pending)
 
-"""
+    def is_alive(self):
+        """Check that the remote end has not closed the connection."""
+        return not self.closed
 
+    def submit(self, request):
+        """Send one request and return a future for its response.
 
-class CommunicationError(Exception):
-    pass
+        One-way requests get no id and no future: None is returned as
+        soon as the request has been sent.
+
+        """
+        if request.get("oneway"):
+            future = rid = None
+        elif request.get("stream"):
+            future = Stream()
+        else:
+            future = Future()
+        self.lock.acquire()
+        try:
+            if self.closed:
+                raise self.error or CommunicationError(
+                    "Connection to {} is closed".format(self.address))
+            if future is not None:
+                rid = next(self.ids)
+                self.pending[rid] = future
+                future.connection = self
+                future.request_id = rid
+                future.method = call_name(request)
+                request = dict(request, id=rid)
+        finally:
+            self.lock.release()
+        try:
+            size = self.transport.send(request)
+        except Exception as e:
+            self.lock.acquire()
+            try:
+                self.pending.pop(rid, None)
+            finally:
+                self.lock.release()
+            if isinstance(e, OSError):
+                self.close()
+            raise
+        self.last_used = time.monotonic()
+        self.calls += 1
+        metrics.client.method(call_name(request)).sent(size)
+        return future
+
+    def abandon(self, future):
+        """Stop waiting for the response of a request."""
+        self.lock.acquire()
+        try:
+            self.pending.pop(future.request_id, None)
+        finally:
+            self.lock.release()
+
+    def grant(self, request_id, credits):
+        """Let the skeleton send credits more chunks of a stream."""
+        self._control({"id": request_id, "credit": credits})
+
+    def cancel(self, request_id):
+        """Stop a stream; the chunks already sent are dropped."""
+        self.lock.acquire()
+        try:
+            self.pending.pop(request_id, None)
+        finally:
+            self.lock.release()
+        self._control({"id": request_id, "cancel": True})
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            self.closed = True
+        finally:
+            self.lock.release()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    # Private methods
+
+    def _control(self, message):
+        """Send a flow control message of a stream."""
+        try:
+            self.transport.send(message)
+        except OSError:
+            self.close()
+
+    def _receive(self):
+        """Hand every incoming response to the future waiting for it."""
+        error = CommunicationError("Connection closed by {}".format(
+            self.address))
+        try:
+            while True:
+                response = self.transport.receive()
+                if response is None:
+                    break
+                if "id" not in response:
+                    # Connection-level error, such as a ServerBusy sent
+                    # when the skeleton turns the connection away.
+                    error = response_error(response)
+                    break
+                self.lock.acquire()
+                try:
+                    rid = response.pop("id", None)
+                    future = self.pending.get(rid)
+                    if future is not None and "chunk" not in response:
+                        # Anything but a chunk is the last response.
+                        del self.pending[rid]
+                finally:
+                    self.lock.release()
+                if future is not None:
+                    self.last_used = time.monotonic()
+                    metrics.client.method(future.method).received(
+                        self.transport.last_size)
+                    future.set_result(response)
+        except (OSError, ValueError, struct.error):
+            pass
+        finally:
+            self.lock.acquire()
+            try:
+                self.closed = True
+                self.error = error
+                pending, self.pending = self.pending, {}
+            finally:
+                self.lock.release()
+            for future in pending.values():
+                future.set_exception(error)
+            self.sock.close()
+
+
+class ConnectionPool(object):
+
+    """Pool of long-lived connections, kept per remote address.
+
+    Connections are shared: a caller gets the connection with the
+    fewest requests in flight. A new connection is only opened when
+    all existing ones have max_in_flight outstanding requests, and at
+    most max_size connections are open, or being opened, towards one
+    address: past that, callers wait for the connections being opened.
+    Connections that have been idle for longer than idle_timeout
+    seconds, or that have been closed by the remote end, are dropped
+    instead of being reused; those of every address are swept at most
+    every idle_timeout seconds, whenever a connection is acquired. codecs and compressions restrict the codecs
+    and compressors offered when opening a connection (see
+    client_transport) and connect_timeout bounds the time spent opening
+    it.
+
+    """
+
+    def __init__(self, max_size=4, max_in_flight=32, idle_timeout=30.0,
+                 codecs=None, connect_timeout=5.0, compressions=None):
+        self.max_size = max_size
+        self.max_in_flight = max_in_flight
+        self.idle_timeout = idle_timeout
+        self.codecs = codecs
+        self.compressions = compressions
+        self.connect_timeout = connect_timeout
+        self.lock = threading.Condition()
+        self.conns = {}
+        self.opening = {}
+        self.next_sweep = time.monotonic() + idle_timeout
+
+    # Public methods
+
+    def acquire(self, address):
+        """Return a healthy connection to address, opening one if needed."""
+        self.lock.acquire()
+        try:
+            now = time.monotonic()
+            if now >= self.next_sweep:
+                self._sweep_all(now)
+            while True:
+                conns = self._sweep(address, now)
+                best = min(conns, key=Connection.in_flight, default=None)
+                opened = len(conns) + self.opening.get(address, 0)
+                if best is not None and (
+                        best.in_flight() < self.max_in_flight or
+                        opened >= self.max_size):
+                    return best
+                if opened < self.max_size:
+                    break
+                # Only connections still being opened: wait for them.
+                self.lock.wait()
+                now = time.monotonic()
+            self.opening[address] = self.opening.get(address, 0) + 1
+        finally:
+            self.lock.release()
+        conn = None
+        try:
+            conn = Connection(address, self.codecs, self.connect_timeout,
+                              self.compressions)
+        finally:
+            self.lock.acquire()
+            try:
+                self.opening[address] -= 1
+                if not self.opening[address]:
+                    del self.opening[address]
+                if conn is not None:
+                    self.conns.setdefault(address, []).append(conn)
+                self.lock.notify_all()
+            finally:
+                self.lock.release()
+        return conn
+
+    def discard(self, conn):
+        """Close a connection that is no longer usable."""
+        self.lock.acquire()
+        try:
+            conns = self.conns.get(conn.address, [])
+            if conn in conns:
+                conns.remove(conn)
+        finally:
+            self.lock.release()
+        conn.close()
+
+    def evict_idle(self):
+        """Close all connections idle for longer than idle_timeout."""
+        self.lock.acquire()
+        try:
+            self._sweep_all(time.monotonic())
+        finally:
+            self.lock.release()
+
+    def close_all(self):
+        """Close every connection in the pool."""
+        self.lock.acquire()
+        try:
+            conns, self.conns = self.conns, {}
+        finally:
+            self.lock.release()
+        for address_conns in conns.values():
+            for conn in address_conns:
+                conn.close()
+
+    # Private methods
+
+    def _sweep(self, address, now):
+        """Drop dead and idle connections to address, return the rest."""
+        conns = self.conns.setdefault(address, [])
+        for conn in conns[:]:
+            if not conn.is_alive() or (
+                    not conn.pending and
+                    now - conn.last_used >= self.idle_timeout):
+                conns.remove(conn)
+                conn.close()
+        return conns
+
+    def _sweep_all(self, now):
+        """Sweep the connections of every address, the lock being held."""
+        for address in list(self.conns):
+            if not self._sweep(address, now) and \
+                    not self.opening.get(address):
+                del self.conns[address]
+        self.next_sweep = now + self.idle_timeout
+
+
+default_pool = ConnectionPool()
 
 
 class Stub(object):
 
     """ Stub for generic objects distributed over the network.
 
-    This is  wrapper object for a socket.
+    This is  wrapper object for a socket. Connections are taken from a
+    ConnectionPool (the module's default_pool unless another one is
+    given) and shared with every other stub of the same address.
+
+    Calls to the methods named in oneway are one-way: they return as
+    soon as the request is sent, without waiting for the remote method
+    to run, and the skeleton sends no response. Any other call can be
+    made one-way through send().
+
+    timeout bounds, in seconds, how long a call waits for its response.
+    Calls made while serving a remote call, or inside an orb.deadline
+    block, are further bounded by that deadline. The remaining time
+    travels with the request so that the remote object drops calls
+    nobody waits for anymore. A call that runs out of time raises (or
+    returns, like other errors) DeadlineExceeded.
+
+    interceptors (default_interceptors unless given) see every request
+    and response of the stub; see Interceptor.
+
+    Calls to a skeleton of this process are handed to it directly
+    (see local_skeletons), and calls to other skeletons of this host
+    go through their Unix domain socket.
 
     """
 
-    def __init__(self, address):
-        self.address = tuple(address)
+    def __init__(self, address, pool=None, oneway=(), timeout=None,
+                 interceptors=None):
+        self.address = address if isinstance(address, str) else tuple(
+            address)
+        self.pool = pool if pool is not None else default_pool
+        self.oneway = frozenset(oneway)
+        self.timeout = timeout
+        self.interceptors = (interceptors if interceptors is not None
+                             else default_interceptors)
 
-    def _rmi(self, method, *args):
-        #
-        # Your code here.
-        #
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Public methods
+
+    def batch(self):
+        """Return a Batch collecting calls to send in a single request."""
+        return Batch(self)
+
+    def call_async(self, method, *args):
+        """Call method without blocking, return a Future of its result.
+
+        Unlike synchronous calls, errors are raised by the future's
+        result() instead of being returned.
+
+        """
+        future = Future()
+        stats = metrics.client.method(method)
+        stats.start()
+        start = time.monotonic()
         try:
-            sock.connect(self.address)
-            worker = sock.makefile(mode="rw")
-            worker.write(json.dumps(
-                {"method": method, "args": args}) + '\n')
-            worker.flush()
-            data = json.loads(worker.readline())
-            if not data:
-                raise(Exception('No data received'))
-            if 'error' in data:
-                exception = type(data["error"]["name"], (Exception,), dict())
-                raise exception(*data["error"]["args"])
-            if 'result' in data:
-                return data['result']
-            else:
-                print('Wrong format on server response')
+            request, _ = self._stamp({"method": method, "args": args})
+            response = self._submit(request)
+        except Exception as e:
+            stats.finish(time.monotonic() - start, True)
+            future.set_exception(e)
+            return future
+
+        def resolve(response):
+            try:
+                future.set_result(unpack_response(
+                    self._received(request, response.result())))
+            except Exception as e:
+                if isinstance(e, (OSError, CommunicationError)):
+                    self._failed(request, e)
+                future.set_exception(e)
+            stats.finish(time.monotonic() - start,
+                         future.exception() is not None)
+        response.add_done_callback(resolve)
+        return future
+
+    def stream(self, method, *args):
+        """Call method and return a lazy iterator over its result.
+
+        A remote method that returns an iterator streams its items back
+        (see Stream); calls to a skeleton of this process iterate the
+        owner's iterator itself.
+
+        """
+        stats = metrics.client.method(method)
+        stats.start()
+        start = time.monotonic()
+        try:
+            request, _ = self._stamp(
+                {"method": method, "args": args, "stream": STREAM_WINDOW})
+            stream = self._submit(request)
+        except Exception:
+            stats.finish(time.monotonic() - start, True)
+            raise
+        if not isinstance(stream, Stream):
+            response = None
+            try:
+                response = self._received(request, stream.result())
+            finally:
+                stats.finish(time.monotonic() - start,
+                             response is None or 'error' in response)
+            return iter(unpack_response(response))
+
+        def ended(outcome):
+            if isinstance(outcome, dict):
+                self._received(request, outcome)
+            elif isinstance(outcome, (OSError, CommunicationError)):
+                self._failed(request, outcome)
+            stats.finish(time.monotonic() - start,
+                         outcome is not None and
+                         (not isinstance(outcome, dict) or 'error' in outcome))
+        stream.ended = ended
+        stream.timeout = self.timeout
+        return stream
+
+    def send(self, method, *args):
+        """Call method one-way, without waiting for a response.
+
+        Errors raised by the remote method are lost; only a failure to
+        send the request is reported.
+
+        """
+        stats = metrics.client.method(method)
+        stats.start()
+        start = time.monotonic()
+        failed = True
+        try:
+            request, _ = self._stamp(
+                {"method": method, "args": args, "oneway": True})
+            self._submit(request)
+            failed = False
         except Exception as e:
             return e
         finally:
-            sock.close()
+            stats.finish(time.monotonic() - start, failed)
+
+    # Private methods
+
+    def _submit(self, request):
+        """Send a request on a pooled connection, return its future.
+
+        A reused connection may have been closed by the server since it
+        was last used, so a failed send on it is retried once on a
+        fresh connection. One-way requests have no future.
+
+        """
+        if self.interceptors:
+            for interceptor in self.interceptors:
+                interceptor.send_request(self.address, request)
+        skeleton = local_skeleton(self.address)
+        if skeleton is not None:
+            return skeleton.submit(request)
+        try:
+            while True:
+                conn = self.pool.acquire(self.address)
+                try:
+                    return conn.submit(request)
+                except (OSError, CommunicationError):
+                    self.pool.discard(conn)
+                    if conn.calls == 0:
+                        raise
+        except (OSError, CommunicationError) as e:
+            self._failed(request, e)
+            raise
+
+    def _stamp(self, request):
+        """Add the remaining time budget to a request.
+
+        Return the request and its deadline (None when unbounded).
+
+        """
+        deadline = current_deadline()
+        if self.timeout is not None:
+            deadline = min_deadline(deadline, time.monotonic() + self.timeout)
+        if deadline is None:
+            return request, None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("No time left to call {}".format(
+                self.address))
+        return dict(request, deadline=remaining), deadline
+
+    def _call(self, request):
+        """Send a request and wait, within its deadline, for the response."""
+        stats = metrics.client.method(call_name(request))
+        stats.start()
+        start = time.monotonic()
+        response = None
+        try:
+            request, deadline = self._stamp(request)
+            response = self._received(request, self._wait(request, deadline))
+            return response
+        finally:
+            stats.finish(time.monotonic() - start,
+                         response is None or 'error' in response)
+
+    def _received(self, request, response):
+        """Run the interceptors on a response, return the response."""
+        if self.interceptors:
+            for interceptor in reversed(self.interceptors):
+                interceptor.receive_response(self.address, request, response)
+        return response
+
+    def _failed(self, request, error):
+        """Run the interceptors and failure_hooks on a request that got
+        no response."""
+        if self.interceptors:
+            for interceptor in reversed(self.interceptors):
+                interceptor.call_failed(self.address, request, error)
+        for hook in list(failure_hooks):
+            hook(self.address, request, error)
+
+    def _wait(self, request, deadline):
+        future = self._submit(request)
+        try:
+            if deadline is None:
+                return future.result()
+            try:
+                return future.result(max(0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                if future.connection is not None:
+                    future.connection.abandon(future)
+                raise DeadlineExceeded("No response from {} in time".format(
+                    self.address))
+        except (OSError, CommunicationError) as e:
+            self._failed(request, e)
+            raise
+
+    def _rmi(self, method, *args):
+        if method in self.oneway:
+            return self.send(method, *args)
+        try:
+            return unpack_response(
+                self._call({"method": method, "args": args}))
+        except Exception as e:
+            return e
 
     def __getattr__(self, attr):
         """Forward call to name over the network at the given address."""
@@ -78,38 +1691,414 @@ class Stub(object):
         return rmi_call
 
 
+# Items sent in one chunk of a stream.
+STREAM_CHUNK = 64
+
+# Seconds a stream of the asyncio skeleton waits for the caller to grant
+# a credit. Streams of Skeleton hold no thread while they wait, so they
+# wait until the caller cancels them or closes the connection.
+STREAM_TIMEOUT = 60.0
+
+
+def close_iterator(iterator):
+    """Release the resources of a generator that will not be resumed."""
+    close = getattr(iterator, "close", None)
+    if close is not None:
+        close()
+
+
+def chunks(iterator, size):
+    """Yield the items of iterator in lists of at most size items."""
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+class Flow(object):
+
+    """State of a stream sent back to the caller (see Stub.stream).
+
+    The caller grants credits, one per chunk it is ready to receive.
+    running is True while the task sending a chunk is queued or running
+    and ended once the stream is over (see Request.pump).
+
+    """
+
+    def __init__(self, request, credits):
+        self.lock = threading.Lock()
+        self.request = request
+        self.credits = credits
+        self.cancelled = False
+        self.iterator = None
+        self.running = False
+        self.ended = False
+
+    def grant(self, credits):
+        self.lock.acquire()
+        try:
+            self.credits += credits
+        finally:
+            self.lock.release()
+
+    def cancel(self):
+        self.lock.acquire()
+        try:
+            self.cancelled = True
+        finally:
+            self.lock.release()
+
+
+class WorkerPool(object):
+
+    """Fixed set of worker threads fed from a bounded queue of tasks."""
+
+    def __init__(self, size, queue_size):
+        self.tasks = queue.Queue(queue_size)
+        for _ in range(size):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+
+    def submit(self, fn, *args):
+        """Queue fn(*args) and return a future for its result.
+
+        Return None instead when the queue is full, so that the caller
+        can shed the task.
+
+        """
+        future = Future()
+        try:
+            self.tasks.put_nowait((future, fn, args))
+        except queue.Full:
+            return None
+        return future
+
+    def queue_depth(self):
+        """Return the number of tasks waiting for a worker."""
+        return self.tasks.qsize()
+
+    # Private methods
+
+    def _work(self):
+        while True:
+            future, fn, args = self.tasks.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+
+# Seconds spent at most on a connection that is being turned away.
+SHED_TIMEOUT = 1.0
+
+# Seconds a peer being destroyed waits for its calls in flight.
+DRAIN_TIMEOUT = 10.0
+
+# Seconds a peer's registration with the name service lasts unless it
+# is renewed, which the peer's name service client does in the
+# background (see nameCache).
+LEASE_TIME = 30.0
+
+
+def busy_response(reason):
+    """Build the error response sent for shed requests."""
+    return {"error": {"name": ServerBusy.__name__, "args": [reason]}}
+
+
+def gather(futures, timeout=None):
+    """Wait for a dictionary of futures, for at most timeout seconds.
+
+    Return a dictionary with the same keys, mapped to the result of
+    each future. Futures that failed map to their exception and those
+    still running when the timeout expires map to a TimeoutError, so
+    a slow or dead peer never holds up the others.
+
+    """
+    done, _ = wait(list(futures.values()), timeout)
+    results = {}
+    for key, future in futures.items():
+        if future not in done:
+            results[key] = TimeoutError(
+                "No response within {} seconds".format(timeout))
+        elif future.exception() is not None:
+            results[key] = future.exception()
+        else:
+            results[key] = future.result()
+    return results
+
+
+class Batch(object):
+
+    """Calls to one remote object, sent together in a single request.
+
+    Used as a context manager, returned by Stub.batch():
+
+        with stub.batch() as batch:
+            fortunes = [batch.read() for _ in range(10)]
+        print([fortune.result() for fortune in fortunes])
+
+    Each call made on the batch returns a Future. The calls are sent
+    when the block exits (or when send() is called) and the skeleton
+    runs them in order, so N calls cost a single round trip.
+
+    """
+
+    def __init__(self, stub):
+        self.stub = stub
+        self.calls = []
+        self.futures = []
+
+    def send(self):
+        """Send the collected calls and resolve their futures."""
+        calls, futures = self.calls, self.futures
+        self.calls, self.futures = [], []
+        if not calls:
+            return
+        try:
+            responses = unpack_response(self.stub._call({"batch": calls}))
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, response in zip(futures, responses):
+            if 'error' in response:
+                future.set_exception(response_error(response))
+            else:
+                future.set_result(response.get('result'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+        return False
+
+    def __getattr__(self, attr):
+        """Queue a call to attr, return the future of its result."""
+        def batch_call(*args):
+            future = Future()
+            self.calls.append({"method": attr, "args": args})
+            self.futures.append(future)
+            return future
+        return batch_call
+
+
 class Request(threading.Thread):
 
-    """Run the incoming requests on the owner object of the skeleton."""
+    """Run the incoming requests on the owner object of the skeleton.
+
+    A request thread reads the requests of one connection and hands
+    them to the skeleton's worker pool. Requests that carry an "id" are
+    run concurrently and their responses, tagged with the same id, are
+    written back as soon as they are ready. Requests without an id come
+    from callers that expect one response per request, in order, and
+    are run one at a time. One-way requests are run without sending any
+    response back. Calls to methods that are not part of the owner's
+    remote interface, and calls to INLINE methods, are answered by the
+    request thread itself. When the worker queue is full the request is
+    answered right away with a ServerBusy error (one-way requests are
+    dropped).
+
+    The iterator returned for a streaming request (see Stub.stream) is
+    sent back in chunks as the caller grants credits, each chunk by a
+    task of its own on the worker pool: a stream waiting for credits
+    holds no worker.
+
+    """
 
-    def __init__(self, owner, conn, addr):
+    def __init__(self, skeleton, conn, addr):
         threading.Thread.__init__(self)
         self.addr = addr
         self.conn = conn
-        self.owner = owner
+        self.skeleton = skeleton
+        self.dispatcher = skeleton.dispatcher
         self.daemon = True
+        self.transport = None
+        self.flows = {}
+
+    def serve(self, request, deadline=None):
+        """Run a request and send its response back to the caller."""
+        streaming = False
+        try:
+            response = self.dispatcher.process(request, deadline)
+            if isinstance(response.get('result'), collections.abc.Iterator):
+                streaming = self.stream(request, response['result'])
+            elif not request.get('oneway'):
+                self.reply(request, response)
+        finally:
+            if not streaming:
+                if request.get('stream'):
+                    self.flows.pop(request.get('id'), None)
+                self.skeleton.leave()
+
+    def stream(self, request, iterator):
+        """Start sending the items of iterator back, one chunk per credit.
+
+        Return True if the stream goes on after this call, in which case
+        the call is over once the stream ends (see finish).
+
+        """
+        flow = self.flows.get(request.get('id'))
+        if flow is None:
+            # Without an id, the caller cannot tell chunks apart.
+            try:
+                self.reply(request, {"result": list(iterator)})
+            except Exception as e:
+                self.reply(request, error_response(e))
+            finally:
+                close_iterator(iterator)
+            return False
+        flow.iterator = iterator
+        self.pump(flow)
+        return True
+
+    def pump(self, flow):
+        """Queue the task sending the next chunk of a stream, if the
+        caller has granted a credit for it, or end a cancelled stream."""
+        flow.lock.acquire()
+        try:
+            if flow.running or flow.ended or flow.iterator is None:
+                return
+            if flow.cancelled:
+                flow.ended = True
+            elif flow.credits:
+                flow.credits -= 1
+                flow.running = True
+            else:
+                return
+        finally:
+            flow.lock.release()
+        if flow.ended:
+            self.finish(flow)
+        elif self.skeleton.workers.submit(self.send_chunk, flow) is None:
+            flow.ended = True
+            self.reply(flow.request, busy_response("Request queue full"))
+            self.finish(flow)
+
+    def send_chunk(self, flow):
+        """Send the next chunk of a stream, or its end."""
+        try:
+            chunk = list(itertools.islice(flow.iterator, STREAM_CHUNK))
+            if chunk:
+                self.reply(flow.request, {"chunk": chunk})
+            else:
+                self.reply(flow.request, {"result": None})
+        except Exception as e:
+            chunk = None
+            self.reply(flow.request, error_response(e))
+        flow.lock.acquire()
+        try:
+            flow.running = False
+            if not chunk:
+                flow.ended = True
+        finally:
+            flow.lock.release()
+        if flow.ended:
+            self.finish(flow)
+        else:
+            self.pump(flow)
+
+    def finish(self, flow):
+        """A stream has ended: release its iterator and end its call."""
+        close_iterator(flow.iterator)
+        self.flows.pop(flow.request.get('id'), None)
+        self.skeleton.leave()
+
+    def close(self):
+        """Close the connection, ending the request thread."""
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def reply(self, request, response):
+        """Send the response to a request back to the caller."""
+        response = self.dispatcher.respond(request, response)
+        if 'id' in request:
+            response['id'] = request['id']
+        try:
+            try:
+                size = self.transport.send(response)
+            except (TypeError, ValueError) as e:
+                # The result cannot be encoded, report that instead.
+                response = dict(error_response(e), id=response.get('id'))
+                size = self.transport.send(response)
+        except OSError:
+            return
+        stats = self.dispatcher.stats(request)
+        if stats is not None:
+            stats.sent(size)
 
     def run(self):
-        #
-        # Your code here.
-        #
-        try:
-            worker = self.conn.makefile(mode="rw")
-            request = worker.readline()
-            request = json.loads(request)
-            if 'method' in request and 'args' in request and hasattr(self.owner, request['method']):
-                method = getattr(self.owner, request['method'])
-                if request['args']:
-                    result = method(*request['args'])
-                else:
-                    result = method()
-            msg = json.dumps({"result": result})
-            worker.write(msg + '\n')
-            worker.flush()
+        """Serve requests on the connection until the caller closes it."""
+        try:
+            self.transport = server_transport(self.conn)
+            while True:
+                request = self.transport.receive()
+                if request is None:
+                    break
+                if 'credit' in request or 'cancel' in request:
+                    # Flow control of a stream.
+                    flow = self.flows.get(request.get('id'))
+                    if flow is None:
+                        continue
+                    if request.get('cancel'):
+                        flow.cancel()
+                    else:
+                        flow.grant(request['credit'])
+                    self.pump(flow)
+                    continue
+                deadline = request_deadline(request)
+                try:
+                    export = self.dispatcher.accept(request)
+                except Exception as e:
+                    if not request.get('oneway'):
+                        self.reply(request, error_response(e))
+                    continue
+                self.dispatcher.stats(request).received(
+                    self.transport.last_size)
+                if not self.skeleton.enter():
+                    if not request.get('oneway'):
+                        self.reply(request,
+                                   busy_response("Server is stopping"))
+                    continue
+                if request.get('stream') and 'id' in request:
+                    self.flows[request['id']] = Flow(request,
+                                                     request['stream'])
+                if export is not None:
+                    if export.oneway and not request.get('oneway'):
+                        # Acknowledge declared one-way methods at once.
+                        self.reply(request, {"result": None})
+                        request = dict(request, oneway=True)
+                    if (export.executor == INLINE and
+                            not request.get('stream')):
+                        self.serve(request, deadline)
+                        continue
+                future = self.skeleton.workers.submit(self.serve, request,
+                                                      deadline)
+                if future is None:
+                    # Dropped: it will never leave on its own.
+                    self.flows.pop(request.get('id'), None)
+                    self.skeleton.leave()
+                    if not request.get('oneway'):
+                        self.reply(request,
+                                   busy_response("Request queue full"))
+                elif request.get('oneway'):
+                    continue
+                elif 'id' not in request:
+                    future.result()
         except Exception as e:
             return e
         finally:
+            for flow in list(self.flows.values()):
+                flow.cancel()
+                self.pump(flow)
             self.conn.close()
+            self.skeleton.closed(self)
 
 
 class Skeleton(threading.Thread):
@@ -119,31 +2108,197 @@ class Skeleton(threading.Thread):
     This is used to listen to an address of the network, manage incoming
     connections and forward calls to the generic owner class.
 
+    Calls are run by a pool of max_workers threads. At most queue_size
+    calls wait for a worker and at most max_connections connections are
+    served at once; anything above these limits is answered with a
+    ServerBusy error instead of piling up threads. backlog is the size
+    of the kernel's queue of connections not yet accepted.
+
+    The owner's dispatch table (see Dispatcher) is built when the
+    skeleton starts, with the given interceptors (see Interceptor).
+
+    If unix_path is given, the skeleton also listens on that Unix domain
+    socket (see unix_path()). Once started, the skeleton serves the
+    stubs of this process directly (see local_skeletons). With
+    reuse_port, several processes can listen to the same port (see
+    Common.processGroup).
+
+    stop() shuts the skeleton down without dropping the calls in flight.
+
     """
 
-    def __init__(self, owner, address):
+    def __init__(self, owner, address, max_workers=32, queue_size=256,
+                 max_connections=1024, backlog=128, interceptors=None,
+                 unix_path=None, reuse_port=False):
         threading.Thread.__init__(self)
         self.address = address
         self.owner = owner
         self.daemon = True
-        #
-        # Your code here.
-        #
-        pass
+        self.backlog = backlog
+        self.interceptors = interceptors
+        self.unix_path = unix_path
+        self.reuse_port = reuse_port
+        self.dispatcher = None
+        self.workers = WorkerPool(max_workers, queue_size)
+        self.connections = threading.BoundedSemaphore(max_connections)
+        self.lock = threading.Condition()
+        self.stopping = False
+        self.in_flight = 0
+        self.listeners = []
+        self.requests = set()
+
+    def start(self):
+        self.dispatcher = Dispatcher(self.owner, self.interceptors)
+        local_skeletons[self.address[1]] = self
+        threading.Thread.start(self)
+
+    def submit(self, request):
+        """Serve a request of this process (see Dispatcher.submit)."""
+        return self.dispatcher.submit(request, self.workers.submit)
+
+    def stop(self, drain_timeout=None):
+        """Stop serving, without dropping the calls in flight.
+
+        The skeleton stops accepting connections at once and answers
+        new requests with a ServerBusy error. The calls in flight are
+        given drain_timeout seconds (no limit if None) to finish, then
+        every connection is closed. Return the number of calls still in
+        flight at that point, 0 if all of them have finished.
+
+        """
+        self.lock.acquire()
+        try:
+            self.stopping = True
+            listeners, self.listeners = self.listeners, []
+        finally:
+            self.lock.release()
+        if local_skeletons.get(self.address[1]) is self:
+            del local_skeletons[self.address[1]]
+        for sock in listeners:
+            try:
+                # Wakes up the thread blocked in accept().
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        if self.unix_path is not None and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+        if drain_timeout is not None:
+            deadline = time.monotonic() + drain_timeout
+        self.lock.acquire()
+        try:
+            while self.in_flight:
+                if drain_timeout is None:
+                    self.lock.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.lock.wait(remaining)
+            left = self.in_flight
+            requests = list(self.requests)
+        finally:
+            self.lock.release()
+        for request in requests:
+            request.close()
+        if left:
+            print("Skeleton stopped with {} calls in flight.".format(left))
+        return left
+
+    def load(self):
+        """Return the number of calls in flight and waiting for a worker."""
+        return [self.in_flight, self.workers.queue_depth()]
+
+    def enter(self):
+        """Count a new call in flight, return False once stopping."""
+        self.lock.acquire()
+        try:
+            if self.stopping:
+                return False
+            self.in_flight += 1
+            return True
+        finally:
+            self.lock.release()
+
+    def leave(self):
+        """A call counted by enter() has been answered."""
+        self.lock.acquire()
+        try:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self.lock.notify_all()
+        finally:
+            self.lock.release()
+
+    def closed(self, request):
+        """A request thread has closed its connection."""
+        self.lock.acquire()
+        try:
+            self.requests.discard(request)
+        finally:
+            self.lock.release()
+        self.connections.release()
 
     def run(self):
-        #
-        # Your code here.
-        #
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         sock.bind(self.address)
-        sock.listen(1)
+        sock.listen(self.backlog)
+        self._listen(sock)
+        if self.unix_path is not None and hasattr(socket, "AF_UNIX"):
+            # We own the TCP port, so any file left at the path is stale.
+            if os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            unix_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            unix_sock.bind(self.unix_path)
+            unix_sock.listen(self.backlog)
+            self._listen(unix_sock)
+            listener = threading.Thread(target=self._accept,
+                                        args=(unix_sock,))
+            listener.daemon = True
+            listener.start()
+        self._accept(sock)
+
+    def shed(self, conn):
+        """Turn away a connection above the max_connections limit."""
+        try:
+            conn.settimeout(SHED_TIMEOUT)
+            server_transport(conn).send(busy_response("Too many connections"))
+        except Exception:
+            pass
+        finally:
+            conn.close()
+
+    # Private methods
+
+    def _listen(self, sock):
+        """Register a listening socket, closed by stop()."""
+        self.lock.acquire()
+        try:
+            if self.stopping:
+                sock.close()
+            else:
+                self.listeners.append(sock)
+        finally:
+            self.lock.release()
 
+    def _accept(self, sock):
+        """Serve the connections of a listening socket."""
         try:
-            while self.daemon:
+            while not self.stopping:
                 try:
-                    conn, addr = sock.accept() 
-                    req = Request(self.owner, conn, addr)
+                    conn, addr = sock.accept()
+                    if not self.connections.acquire(blocking=False):
+                        self.shed(conn)
+                        continue
+                    req = Request(self, conn, addr)
+                    self.lock.acquire()
+                    try:
+                        self.requests.add(req)
+                    finally:
+                        self.lock.release()
                     req.start()
                 except socket.error:
                     continue
@@ -153,34 +2308,89 @@ class Skeleton(threading.Thread):
             sock.close()
 
 
-
 class Peer:
 
     """Class, extended by objects that communicate over the network."""
 
-    def __init__(self, l_address, ns_address, ptype):
+    def __init__(self, l_address, ns_address, ptype, skeleton_class=None,
+                 **skeleton_args):
         self.type = ptype
         self.hash = ""
         self.id = -1
         self.address = l_address
-        self.skeleton = Skeleton(self, ('', l_address[1]))
+        # Called with the membership changes pushed by the name service
+        # to the watchers of a type (see PeerList).
+        self.membership = None
+        if skeleton_class is None:
+            skeleton_class = Skeleton
+        skeleton_args.setdefault("unix_path", unix_path(l_address[1]))
+        self.skeleton = skeleton_class(self, ('', l_address[1]),
+                                       **skeleton_args)
         self.name_service_address = ns_address
-        self.name_service = Stub(self.name_service_address)
+        # Imported here as nameCache is built on this module.
+        from . import nameCache
+        self.name_service = nameCache.name_service(self.name_service_address)
 
     # Public methods
 
     def start(self):
-        """Start the communication interface."""
+        """Start the communication interface.
+
+        The object is registered with the name service under a lease of
+        LEASE_TIME seconds, renewed in the background until destroy,
+        along with the load of its skeleton (see NameService.require_any).
+        Should the lease be lost, the object is registered again and
+        moved is called with its new id and hash.
+
+        """
         self.skeleton.start()
-        self.id, self.hash = self.name_service.register(self.type,
-                                                        self.address)
+        self.id, self.hash = self.name_service.register(
+            self.type, self.address, LEASE_TIME, self.skeleton.load,
+            self.moved)
+
+    def moved(self, oid, ohash):
+        """The object was registered again, under a new id.
+
+        Subclasses holding state keyed by the id (see PeerList.moved)
+        extend this method.
+
+        """
+
+        print("Registered again with id {} after losing the lease.".format(
+            oid))
+        self.id, self.hash = oid, ohash
 
-    def destroy(self):
-        """Unregister the object before removal."""
+    def destroy(self, drain_timeout=DRAIN_TIMEOUT):
+        """Unregister the object before removal.
+
+        The skeleton is then stopped once the calls in flight have been
+        answered, or after drain_timeout seconds (see Skeleton.stop).
+
+        """
 
         self.name_service.unregister(self.id, self.type, self.hash)
+        self.skeleton.stop(drain_timeout)
 
+    @remote(executor=INLINE)
     def check(self):
         """Checking to see if the object is still alive."""
 
         return (self.id, self.type)
+
+    @remote(oneway=True)
+    def membership_changed(self, otype, first, last, changes):
+        """Membership changes of a type watched through the name service."""
+
+        if self.membership is not None:
+            self.membership(otype, first, last, changes)
+
+    @remote(executor=INLINE)
+    def orb_metrics(self):
+        """Return the metrics of the remote calls of this process.
+
+        This method is reserved on every peer so that the metrics of a
+        whole system can be collected through the peers' stubs.
+
+        """
+
+        return metrics.snapshot()
@@ -0,0 +1,98 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Added to the lab framework: 18 October 2026
+# (not part of the original course material)
+# -----------------------------------------------------------------------------
+
+"""Serving one port from several processes.
+
+A single Python process runs its Python code on one core at a time. To
+use all the cores of a machine, a server forks worker processes that
+listen to the same port (each with SO_REUSEPORT, the kernel spreads the
+incoming connections over them):
+
+--  the process that forks, the owner, keeps the writable state and
+    listens on a private Unix domain socket (see owner_path) for the
+    requests the workers cannot serve themselves,
+--  the workers share what the owner had loaded before forking
+    (copy-on-write) and forward writes to the owner.
+
+Fork before starting any thread: threads do not survive in the workers.
+
+"""
+
+import atexit
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+# Seconds between two checks that the owner process is still alive.
+OWNER_CHECK_INTERVAL = 1.0
+
+
+def reuse_port_supported():
+    """Return True if several processes can listen to the same port."""
+    return hasattr(socket, "SO_REUSEPORT") and hasattr(os, "fork")
+
+
+def owner_path(port):
+    """Return the path of the owner's private socket for a port."""
+    return os.path.join(tempfile.gettempdir(),
+                        "orb-{}-owner.sock".format(port))
+
+
+def fork_workers(count):
+    """Fork count worker processes.
+
+    Return 0 in the calling process, the owner, and the number of the
+    worker, from 1 to count, in each worker. The owner terminates its
+    workers when it exits and a worker exits as soon as its owner is
+    gone.
+
+    """
+    workers = []
+    owner = os.getpid()
+    for index in range(1, count + 1):
+        pid = os.fork()
+        if pid == 0:
+            _watch_owner(owner)
+            return index
+        workers.append(pid)
+    atexit.register(_terminate, workers)
+    return 0
+
+
+def wait_forever():
+    """Block a worker's main thread until the process is terminated."""
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+# Private functions
+
+
+def _watch_owner(owner):
+    """Exit the current worker process once the owner has died."""
+    def watch():
+        while os.getppid() == owner:
+            time.sleep(OWNER_CHECK_INTERVAL)
+        os._exit(0)
+    watcher = threading.Thread(target=watch)
+    watcher.daemon = True
+    watcher.start()
+
+
+def _terminate(workers):
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except OSError:
+            pass
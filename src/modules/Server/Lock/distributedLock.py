@@ -28,10 +28,15 @@ The implementation should satisfy the following requests:
 
 """
 
+from Common import orb
+
 NO_TOKEN = 0
 TOKEN_PRESENT = 1
 TOKEN_HELD = 2
 
+# Seconds to wait for a peer to answer a token request.
+REQUEST_TIMEOUT = 5.0
+
 
 class DistributedLock(object):
 
@@ -43,6 +48,7 @@ class DistributedLock(object):
         --  destroy()
         --  register_peer(pid)
         --  unregister_peer(pid)
+        --  moved(old_id)
         --  acquire()
         --  release()
         --  request_token(time, pid)
@@ -62,9 +68,10 @@ class DistributedLock(object):
     def _prepare(self, token):
         """Prepare the token to be sent as a JSON message.
 
-        This step is necessary because in the JSON standard, the key to
-        a dictionary must be a string whild in the token the key is
-        integer.
+        The binary codecs of the ORB keep integer dictionary keys, but
+        a peer may still have negotiated the JSON codec, in which the
+        key to a dictionary must be a string whild in the token the key
+        is integer.
         """
         return list(token.items())
 
@@ -131,7 +138,8 @@ class DistributedLock(object):
                 key = peer_keys[i-1]
                 if key is not i:
                     try:
-                        peers[key].obtain_token(self._prepare(self.token))
+                        peers[key].send("obtain_token",
+                                        self._prepare(self.token))
                     except:
                         pass
         finally:
@@ -144,8 +152,9 @@ class DistributedLock(object):
         #
         self.peer_list.lock.acquire()
         try:
-            self.request[pid] = 0
-            if self.token is not None: self.token[pid] = 0
+            # Registering a peer twice must not erase its request.
+            self.request.setdefault(pid, 0)
+            if self.token is not None: self.token.setdefault(pid, 0)
             
         finally:
             self.peer_list.lock.release()
@@ -157,8 +166,18 @@ class DistributedLock(object):
         #
         self.peer_list.lock.acquire()
         try:
-            del self.token[pid]
-            del self.request[pid]
+            if self.token is not None: self.token.pop(pid, None)
+            self.request.pop(pid, None)
+        finally:
+            self.peer_list.lock.release()
+
+    def moved(self, old_id):
+        """Called when this peer was registered again under a new id."""
+        self.peer_list.lock.acquire()
+        try:
+            self.request[self.owner.id] = self.request.pop(old_id, 0)
+            if self.token is not None and old_id in self.token:
+                self.token[self.owner.id] = self.token.pop(old_id)
         finally:
             self.peer_list.lock.release()
 
@@ -174,11 +193,13 @@ class DistributedLock(object):
             self.time += 1
             if self.state == NO_TOKEN:
                 self.peer_list.lock.release()
-                for pid in peers:
-                    try:
-                        peers[pid].request_token(self.time, self.owner.id)
-                    except:
-                        continue
+                # Ask all peers in parallel; dead peers only cost the
+                # timeout once.
+                orb.gather({
+                    pid: peers[pid].call_async("request_token", self.time,
+                                               self.owner.id)
+                    for pid in peers
+                }, REQUEST_TIMEOUT)
                 self.peer_list.lock.acquire()
                 
             self.peer_list.lock.release()
@@ -207,11 +228,12 @@ class DistributedLock(object):
                 peer_keys.sort()
                 i = peer_keys.index(self.owner.id)
                 for k in peer_keys[i+1:]+peer_keys[:i]:
-                    if self.request[k] > self.token[k]:
+                    if self.request.get(k, 0) > self.token.get(k, 0):
                     
                         self.token[self.owner.id] = self.time
                         try:
-                            peers[k].obtain_token(self._prepare(self.token))
+                            peers[k].send("obtain_token",
+                                          self._prepare(self.token))
                             self.state = NO_TOKEN
                             self.token = {}
                             break
@@ -225,10 +247,13 @@ class DistributedLock(object):
         #
         # Your code here.
         #
+        if pid not in self.peer_list.get_peers():
+            # Its join has not reached us yet.
+            self.peer_list.discover(pid)
         self.peer_list.lock.acquire()
         try:
             print(pid ," is requesting the lock...")
-            self.request[pid] = max(self.request[pid], time)
+            self.request[pid] = max(self.request.get(pid, 0), time)
             if self.state == TOKEN_PRESENT:
                 self.release()
         finally:
@@ -244,6 +269,9 @@ class DistributedLock(object):
         self.peer_list.lock.acquire()
         try:
             self.token = self._unprepare(token)
+            # The sender may not know all our peers yet.
+            for pid in self.request:
+                self.token.setdefault(pid, 0)
             self.state = TOKEN_PRESENT
         finally:
             self.peer_list.lock.release()
@@ -7,34 +7,117 @@
 # Copyright 2012 Linkoping University
 # -----------------------------------------------------------------------------
 
-"""Implementation of a simple database class."""
+"""Implementation of a simple database class.
 
+Database loads all the fortunes in memory, packed in a Fortunes
+sequence. MappedDatabase reads them from a memory map of the file
+instead, through an index of where they start, so that it opens large
+files at once and that the processes serving one file share its pages.
+
+In the file, every fortune is followed by a line holding only "%".
+
+"""
+
+import array
+import mmap
+import os
 import random
+import struct
+import threading
+import zlib
+
+# Bytes of the database file read at once when loading it.
+LOAD_CHUNK = 1 << 20
+
+
+def record_ends(data, position=0):
+    """Yield the end offsets of the fortunes in data after position.
+
+    position must be the start of a line. A fortune ends after its
+    "%" line.
+
+    """
+    while True:
+        found = data.find(b"%\n", position)
+        if found < 0:
+            return
+        if found == position or data[found - 1:found] == b"\n":
+            yield found + 2
+        position = found + 2
+
+
+def reseed_after_fork(rand):
+    """Reseed rand in the processes forked from this one.
+
+    Only the module-level generator of random is reseeded by Python, so
+    without this the worker processes serving a database (see
+    Common.processGroup) would all read the same fortunes.
+
+    """
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=rand.seed)
+
+
+class Fortunes(object):
+
+    """Compact, append-only sequence of fortunes.
+
+    The fortunes are stored UTF-8 encoded one after the other in a
+    single bytearray, and the offsets of their ends in an array, rather
+    than as one string object each. Indexing decodes the fortune.
+
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.ends = array.array("Q")
+
+    def append(self, fortune):
+        """Append a fortune, given as a string or as UTF-8 bytes."""
+        if isinstance(fortune, str):
+            fortune = fortune.encode()
+        self.data += fortune
+        self.ends.append(len(self.data))
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, i):
+        if not isinstance(i, int):
+            raise TypeError("Fortunes indices must be integers")
+        end = self.ends[i]
+        if i < 0:
+            i += len(self.ends)
+        start = self.ends[i - 1] if i > 0 else 0
+        return self.data[start:end].decode()
+
+    def __iter__(self):
+        for i in range(len(self.ends)):
+            yield self[i]
 
 
 class Database(object):
 
-    """Class containing a database implementation."""
+    """Class containing a database implementation.
+
+    Another process may append fortunes to the file (see refresh).
+
+    """
 
     def __init__(self, db_file):
         self.db_file = db_file
         self.rand = random.Random()
         self.rand.seed()
-        self.fortunes = []
-        with open(self.db_file, 'r') as DB:
-            line = DB.readline()
-            fortune = ''
-            while line:
-                if (line == '%\n'):
-                    self.fortunes.append(fortune)
-                    fortune = ''
-                else:
-                    fortune += line
-                line = DB.readline()
+        reseed_after_fork(self.rand)
+        self.fortunes = Fortunes()
+        # Bytes of the file loaded so far.
+        self.offset = 0
+        self.lock = threading.Lock()
+        self._load()
 
     def read(self):
         """Read a random location in the database."""
-        if self.fortunes == []: return
+        if len(self.fortunes) == 0: return
         return self.rand.choice(self.fortunes)
 
     def write(self, fortune):
@@ -44,3 +127,215 @@ class Database(object):
                 DB.write(fortune+'\n%\n')
             finally:
                 self.fortunes.append(fortune)
+        self.offset = os.path.getsize(self.db_file)
+
+    def refresh(self):
+        """Load the fortunes appended to the file by another process."""
+        if os.path.getsize(self.db_file) != self.offset:
+            self.lock.acquire()
+            try:
+                self._load()
+            finally:
+                self.lock.release()
+
+    # Private methods
+
+    def _load(self):
+        """Load the complete fortunes stored after offset."""
+        with open(self.db_file, 'rb') as DB:
+            DB.seek(self.offset)
+            # The start of a fortune not complete in the last chunk.
+            pending = b''
+            while True:
+                chunk = DB.read(LOAD_CHUNK)
+                if not chunk:
+                    break
+                data = pending + chunk if pending else chunk
+                view = memoryview(data)
+                start = 0
+                for end in record_ends(data):
+                    self.fortunes.append(view[start:end - 2])
+                    start = end
+                self.offset += start
+                pending = data[start:]
+
+
+class MappedDatabase(object):
+
+    """Database read through a memory map of its file.
+
+    The offsets of the ends of the fortunes are kept in an index file
+    beside the database (db_file + ".idx"), itself memory mapped. The
+    index records the modification time of the database it was built
+    for and a CRC-32 of the last CHECKED bytes it covers, and is rebuilt
+    when they do not match the database anymore; fortunes appended since
+    it was written are indexed on top of it. Only a rewrite of the
+    database that keeps its size and modification time, or that makes
+    it longer while keeping the last CHECKED bytes of the indexed part,
+    goes unnoticed.
+
+    Where the index file cannot be written, the index is only kept in
+    memory.
+
+    Like Database, the fortunes appended to the file by another process
+    are seen after refresh.
+
+    """
+
+    # Index header: magic, modification time of the database in ns and
+    # CRC-32 of the last CHECKED bytes indexed.
+    HEADER = struct.Struct("=8sQQ")
+    MAGIC = b"FORTIDX2"
+    CHECKED = 4096
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.index_file = db_file + ".idx"
+        self.rand = random.Random()
+        self.rand.seed()
+        reseed_after_fork(self.rand)
+        self.lock = threading.Lock()
+        self.data = b""
+        # Fortune i is data[ends[i - 1]:ends[i] - 2] (the 2 bytes of
+        # "%\n" are left out), with ends[-1] taken as 0. The ends stored
+        # in the index file are in index, those found since in tail.
+        self.index = array.array("Q")
+        self.tail = array.array("Q")
+        # Number of ends written to the index file, which is not written
+        # at all unless saving.
+        self.indexed = 0
+        self.saving = True
+        self._open()
+
+    # Public methods
+
+    def read(self):
+        """Read a random location in the database."""
+        count = len(self.index) + len(self.tail)
+        if count == 0:
+            return
+        data = self.data
+        i = self.rand.randrange(count)
+        start = self._end(i - 1) if i > 0 else 0
+        return data[start:self._end(i) - 2].decode()
+
+    def write(self, fortune):
+        """Write a new fortune to the database."""
+        self.lock.acquire()
+        try:
+            with open(self.db_file, 'ab') as DB:
+                DB.write((fortune + '\n%\n').encode())
+            self._extend()
+            self._save()
+        finally:
+            self.lock.release()
+
+    def refresh(self):
+        """Index the fortunes appended to the file by another process."""
+        if os.path.getsize(self.db_file) != len(self.data):
+            self.lock.acquire()
+            try:
+                self._extend()
+            finally:
+                self.lock.release()
+
+    @property
+    def offset(self):
+        """Bytes of the file indexed so far."""
+        count = len(self.index) + len(self.tail)
+        return self._end(count - 1) if count else 0
+
+    # Private methods
+
+    def _end(self, i):
+        if i < len(self.index):
+            return self.index[i]
+        return self.tail[i - len(self.index)]
+
+    def _open(self):
+        """Map the database and its index, rebuilding the index if stale."""
+        self._map()
+        if not self._load_index():
+            self._build_index()
+        self._extend()
+        self._save()
+
+    def _map(self):
+        """Map the current content of the database file."""
+        with open(self.db_file, 'rb') as DB:
+            size = os.fstat(DB.fileno()).st_size
+            if size > 0:
+                self.data = mmap.mmap(DB.fileno(), size,
+                                      access=mmap.ACCESS_READ)
+
+    def _load_index(self):
+        """Map the index file, return False if it is missing or stale."""
+        try:
+            with open(self.index_file, 'rb') as IDX:
+                size = os.fstat(IDX.fileno()).st_size
+                if size < self.HEADER.size or \
+                        (size - self.HEADER.size) % self.index.itemsize:
+                    return False
+                data = mmap.mmap(IDX.fileno(), size, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        magic, mtime, crc = self.HEADER.unpack_from(data)
+        index = memoryview(data)[self.HEADER.size:].cast("Q")
+        end = index[-1] if len(index) else 0
+        if magic != self.MAGIC or end > len(self.data):
+            return False
+        if crc != self._crc(end):
+            return False
+        if end == len(self.data):
+            # Same size: the file must not have been rewritten since.
+            if mtime != os.stat(self.db_file).st_mtime_ns:
+                return False
+        elif end > 0 and self.data[end - 2:end] != b"%\n":
+            # Only appends are indexed on top of an index.
+            return False
+        self.index = index
+        self.tail = array.array("Q")
+        self.indexed = len(index)
+        return True
+
+    def _build_index(self):
+        """Start a new index file, indexing the whole database."""
+        self.index = array.array("Q")
+        self.tail = array.array("Q")
+        self.indexed = 0
+        try:
+            with open(self.index_file + ".tmp", 'wb') as IDX:
+                IDX.write(self.HEADER.pack(self.MAGIC, 0, 0))
+            os.replace(self.index_file + ".tmp", self.index_file)
+        except OSError:
+            # Read-only directory: index in memory only, leaving the
+            # stale index file, if any, alone.
+            self.saving = False
+
+    def _extend(self):
+        """Index the complete fortunes after the last indexed one."""
+        if os.path.getsize(self.db_file) != len(self.data):
+            self._map()
+        self.tail.extend(record_ends(self.data, self.offset))
+
+    def _save(self):
+        """Append the ends found since to the index file."""
+        if not self.saving:
+            return
+        ends = len(self.index) + len(self.tail)
+        try:
+            with open(self.index_file, 'r+b') as IDX:
+                IDX.seek(0, os.SEEK_END)
+                IDX.write(self.tail[self.indexed - len(self.index):].tobytes())
+                IDX.seek(0)
+                IDX.write(self.HEADER.pack(
+                    self.MAGIC, os.stat(self.db_file).st_mtime_ns,
+                    self._crc(self.offset)))
+        except OSError:
+            # A read-only index is still fine for reading.
+            return
+        self.indexed = ends
+
+    def _crc(self, end):
+        """Return the CRC-32 of the last CHECKED bytes before end."""
+        return zlib.crc32(self.data[max(0, end - self.CHECKED):end])
@@ -0,0 +1,421 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Added to the lab framework: 18 October 2026
+# (not part of the original course material)
+# -----------------------------------------------------------------------------
+
+"""In-memory name service.
+
+Objects register their type and address and get back an id, unique
+among the objects of their type, and a secret hash that they must show
+to unregister. Ids grow with every registration, so an object
+registered later always has a higher id than the objects of its type
+registered before it (PeerList relies on that).
+
+Objects may also watch the membership of a type instead of asking for
+all of its objects again and again. Every registration and
+unregistration increments the version of its type. watch returns the
+objects of a type with its current version, and from then on the name
+service pushes the changes to the watcher, in batches, with one-way
+calls of its method
+
+    membership_changed(type, first, last, changes)
+
+where changes is a list of [version, id, address] (address is None when
+the object has left) taking the type from version first to last. The
+batches of a watcher may arrive out of order, or not at all, see
+PeerList. A watcher that could not be reached PUSH_FAILURES times in a
+row is dropped.
+
+A registration may be leased: the object is then removed, as if it had
+unregistered, unless it renews its lease within the given number of
+seconds. Objects renew their leases in batches, all the objects of a
+process at once (see Common.nameCache), and so the objects of a crashed
+process soon disappear from the lookups.
+
+The renewals may carry the load of each object, as its number of calls
+in flight and of calls waiting for a worker, for require_any to send
+clients to the least loaded objects rather than to random ones.
+
+"""
+
+import heapq
+import random
+import secrets
+import threading
+import time
+
+from Common import orb
+
+# Seconds during which membership changes are collected before being
+# pushed, so that a join storm costs each watcher a few messages rather
+# than one per change.
+NOTIFY_INTERVAL = 0.05
+
+# Failed pushes in a row after which a watcher is dropped.
+PUSH_FAILURES = 3
+
+# Seconds between two purges of the expired leases. Lookups purge them
+# as well, so this only bounds how late the watchers learn about them.
+PURGE_INTERVAL = 1.0
+
+# Policies of require_any: an object chosen at random, the less loaded
+# of two objects chosen at random ("power of two choices") or the least
+# loaded object.
+RANDOM = "random"
+TWO_CHOICES = "p2c"
+LEAST_LOADED = "least"
+
+
+class Registry(object):
+
+    """The objects registered under one type.
+
+    Every lookup is O(1): objects are kept in a dictionary by id, and
+    their ids in a list as well so that require_any can pick one at
+    random. An unregistered id is replaced in the list by the last one.
+
+    Each object is kept as [address, hash, expiry, load], expiry being
+    None for objects registered without a lease. load is the last load
+    reported by the object plus the number of clients sent to it since.
+
+    """
+
+    def __init__(self):
+        self.next_id = 1
+        self.version = 0
+        self.objects = {}
+        self.ids = []
+        self.positions = {}
+
+    # Public methods
+
+    def add(self, address, expiry=None):
+        """Add an object, return its id and hash."""
+        oid = self.next_id
+        self.next_id += 1
+        ohash = secrets.token_hex(16)
+        self.version += 1
+        self.objects[oid] = [address, ohash, expiry, 0]
+        self.positions[oid] = len(self.ids)
+        self.ids.append(oid)
+        return oid, ohash
+
+    def remove(self, oid, ohash):
+        """Remove an object, provided its hash is the right one.
+
+        Return the address of the object.
+
+        """
+        self._check(oid, ohash)
+        return self.discard(oid)
+
+    def renew(self, oid, ohash, expiry, load=None):
+        """Move the expiry of an object's lease, update its load."""
+        entry = self._check(oid, ohash)
+        entry[2] = expiry
+        if load is not None:
+            entry[3] = sum(load)
+
+    def pick(self, policy, rand):
+        """Return the id of an object chosen following policy."""
+        if not self.ids:
+            return None
+        if policy == RANDOM:
+            return self.ids[rand.randrange(len(self.ids))]
+        if policy == TWO_CHOICES:
+            candidates = rand.sample(self.ids, min(2, len(self.ids)))
+        elif policy == LEAST_LOADED:
+            candidates = self.ids
+        else:
+            raise ValueError("Unknown policy '{}'".format(policy))
+        least = min(self.objects[oid][3] for oid in candidates)
+        oid = rand.choice([oid for oid in candidates
+                           if self.objects[oid][3] == least])
+        # Until its next report, count the client sent to the object.
+        self.objects[oid][3] += 1
+        return oid
+
+    def discard(self, oid):
+        """Remove an object, return its address."""
+        entry = self.objects.pop(oid)
+        self.version += 1
+        position = self.positions.pop(oid)
+        last = self.ids.pop()
+        if last != oid:
+            self.ids[position] = last
+            self.positions[last] = position
+        return entry[0]
+
+    def __len__(self):
+        return len(self.objects)
+
+    # Private methods
+
+    def _check(self, oid, ohash):
+        """Return the entry of an object, if ohash is its hash."""
+        entry = self.objects.get(oid)
+        if entry is None:
+            raise KeyError("No object with id {}".format(oid))
+        if not secrets.compare_digest(entry[1], ohash):
+            raise ValueError("Wrong hash for object {}".format(oid))
+        return entry
+
+
+class NameService(object):
+
+    """Owner object of a name service skeleton.
+
+    Its methods are short and never block, so they all run inline, on
+    the threads reading the connections.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.registries = {}
+        self.random = random.Random()
+        # type -> {address: stub} of the watchers of the type
+        self.watchers = {}
+        # (type, address) -> failed pushes in a row to a watcher
+        self.failures = {}
+        # type -> [first version, changes] not pushed yet
+        self.changes = {}
+        self.changed = threading.Condition(self.lock)
+        self.notifier = None
+        # Heap of (expiry, type, id); entries whose lease has been
+        # renewed since are skipped.
+        self.leases = []
+        self.purger = None
+
+    # Public methods
+
+    @orb.remote(executor=orb.INLINE)
+    def register(self, otype, address, lease=None):
+        """Register an object, return its id and hash.
+
+        Unless lease is None, the object is removed after lease seconds
+        without renewing it.
+
+        """
+        self.lock.acquire()
+        try:
+            registry = self.registries.get(otype)
+            if registry is None:
+                registry = self.registries[otype] = Registry()
+            expiry = self._lease(lease)
+            oid, ohash = registry.add(address, expiry)
+            if expiry is not None:
+                heapq.heappush(self.leases, (expiry, otype, oid))
+            self._change(otype, registry.version, oid, address)
+            return oid, ohash
+        finally:
+            self.lock.release()
+
+    @orb.remote(executor=orb.INLINE)
+    def unregister(self, oid, otype, ohash):
+        """Unregister an object, given the hash obtained at registration."""
+        self.lock.acquire()
+        try:
+            registry = self._registry(otype)
+            address = registry.remove(oid, ohash)
+            self._change(otype, registry.version, oid, None)
+            self.watchers.get(otype, {}).pop(tuple(address), None)
+        finally:
+            self.lock.release()
+
+    @orb.remote(executor=orb.INLINE)
+    def renew(self, leases, lease):
+        """Renew the leases of [id, type, hash] triples for lease seconds.
+
+        A triple may be followed by the load of the object: its number
+        of calls in flight and of calls waiting for a worker. Return the
+        [id, type] pairs of those that had already expired, were never
+        registered or came with a wrong hash.
+
+        """
+        self.lock.acquire()
+        try:
+            self._purge()
+            expiry = self._lease(lease)
+            lost = []
+            for renewal in leases:
+                oid, otype, ohash = renewal[:3]
+                load = renewal[3] if len(renewal) > 3 else None
+                try:
+                    self._registry(otype).renew(oid, ohash, expiry, load)
+                except (KeyError, ValueError):
+                    lost.append((oid, otype))
+                    continue
+                heapq.heappush(self.leases, (expiry, otype, oid))
+            return lost
+        finally:
+            self.lock.release()
+
+    @orb.remote(executor=orb.INLINE)
+    def require_all(self, otype):
+        """Return the [id, address] pairs of all objects of a type."""
+        self.lock.acquire()
+        try:
+            self._purge()
+            registry = self.registries.get(otype)
+            if registry is None:
+                return []
+            return [(oid, entry[0])
+                    for oid, entry in registry.objects.items()]
+        finally:
+            self.lock.release()
+
+    @orb.remote(executor=orb.INLINE)
+    def require_any(self, otype, policy=RANDOM):
+        """Return the address of an object of a type.
+
+        policy is RANDOM, TWO_CHOICES or LEAST_LOADED; the last one
+        looks at every object of the type.
+
+        """
+        self.lock.acquire()
+        try:
+            self._purge()
+            oid = self._registry(otype).pick(policy, self.random)
+            if oid is None:
+                raise KeyError("No object of type '{}'".format(otype))
+            return self.registries[otype].objects[oid][0]
+        finally:
+            self.lock.release()
+
+    @orb.remote(executor=orb.INLINE)
+    def require_object(self, otype, oid):
+        """Return the address of the object of a type with a given id."""
+        self.lock.acquire()
+        try:
+            self._purge()
+            entry = self._registry(otype).objects.get(oid)
+            if entry is None:
+                raise KeyError("No object of type '{}' with id {}".format(
+                    otype, oid))
+            return entry[0]
+        finally:
+            self.lock.release()
+
+    @orb.remote(executor=orb.INLINE)
+    def watch(self, otype, address):
+        """Push the membership changes of a type to the object at address.
+
+        Return the current version of the type and the [id, address]
+        pairs of its objects.
+
+        """
+        self.lock.acquire()
+        try:
+            self._purge()
+            registry = self.registries.get(otype)
+            if registry is None:
+                registry = self.registries[otype] = Registry()
+            self.watchers.setdefault(otype, {})[tuple(address)] = \
+                orb.Stub(address)
+            if self.notifier is None:
+                self.notifier = threading.Thread(target=self._notify)
+                self.notifier.daemon = True
+                self.notifier.start()
+            return registry.version, [(oid, entry[0]) for oid, entry
+                                      in registry.objects.items()]
+        finally:
+            self.lock.release()
+
+    @orb.remote(executor=orb.INLINE)
+    def unwatch(self, otype, address):
+        """Stop pushing the membership changes of a type to address."""
+        self.lock.acquire()
+        try:
+            self.watchers.get(otype, {}).pop(tuple(address), None)
+        finally:
+            self.lock.release()
+
+    @orb.remote(executor=orb.INLINE)
+    def orb_metrics(self):
+        """Return the metrics of the remote calls of this process."""
+        return orb.metrics.snapshot()
+
+    # Private methods
+
+    def _lease(self, lease):
+        """Return the expiry of a lease, starting the purges if needed."""
+        if lease is None:
+            return None
+        if self.purger is None:
+            self.purger = threading.Thread(target=self._purge_forever)
+            self.purger.daemon = True
+            self.purger.start()
+        return time.monotonic() + lease
+
+    def _purge(self):
+        """Remove the objects whose lease has expired, the lock being held."""
+        now = time.monotonic()
+        while self.leases and self.leases[0][0] <= now:
+            expiry, otype, oid = heapq.heappop(self.leases)
+            registry = self.registries[otype]
+            entry = registry.objects.get(oid)
+            if entry is None or entry[2] != expiry:
+                # Unregistered or renewed since.
+                continue
+            address = registry.discard(oid)
+            self._change(otype, registry.version, oid, None)
+            self.watchers.get(otype, {}).pop(tuple(address), None)
+
+    def _purge_forever(self):
+        while True:
+            time.sleep(PURGE_INTERVAL)
+            self.lock.acquire()
+            try:
+                self._purge()
+            finally:
+                self.lock.release()
+
+    def _change(self, otype, version, oid, address):
+        """Queue a membership change for the watchers, the lock being held."""
+        if not self.watchers.get(otype):
+            return
+        pending = self.changes.setdefault(otype, [version - 1, []])
+        pending[1].append((version, oid, address))
+        self.changed.notify()
+
+    def _notify(self):
+        """Push the queued membership changes, forever."""
+        while True:
+            self.lock.acquire()
+            try:
+                while not self.changes:
+                    self.changed.wait()
+                changes, self.changes = self.changes, {}
+                watchers = {otype: list(self.watchers.get(otype, {}).items())
+                            for otype in changes}
+            finally:
+                self.lock.release()
+            for otype, (first, batch) in changes.items():
+                last = batch[-1][0]
+                for address, stub in watchers[otype]:
+                    error = stub.send("membership_changed", otype, first,
+                                      last, batch)
+                    self._pushed(otype, address, error)
+            time.sleep(NOTIFY_INTERVAL)
+
+    def _pushed(self, otype, address, error):
+        """Count the failed pushes to a watcher, dropping it after
+        PUSH_FAILURES of them in a row."""
+        key = (otype, address)
+        if not isinstance(error, Exception):
+            self.failures.pop(key, None)
+            return
+        self.failures[key] = self.failures.get(key, 0) + 1
+        if self.failures[key] >= PUSH_FAILURES:
+            # The watcher is gone.
+            del self.failures[key]
+            self.unwatch(otype, address)
+
+    def _registry(self, otype):
+        registry = self.registries.get(otype)
+        if registry is None:
+            raise KeyError("No object of type '{}'".format(otype))
+        return registry
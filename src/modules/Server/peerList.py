@@ -7,11 +7,33 @@
 # Copyright 2012 Linkoping University
 # -----------------------------------------------------------------------------
 
-"""Package for handling a list of objects of the same type as a given one."""
+"""Package for handling a list of objects of the same type as a given one.
+
+The list follows the membership pushed by the name service (see
+Server.nameService): the peers are added and removed as the name
+service reports them joining and leaving. With a name service that
+cannot be watched, the peers register at each other instead.
+
+In both cases a new peer registers itself at the existing peers, and
+waits for them to have done so, before initialize returns: the name
+service pushes the changes late, and until then the existing peers
+would not know the new one.
+
+The pushes are one-way calls, which may be lost. A batch still missing
+GAP_TIMEOUT seconds after a later one arrived is given up on: the list
+watches the membership again and catches up with the fresh snapshot.
+
+"""
 
 import threading
 from Common import orb
 
+# Seconds a new peer waits for the existing peers to register it.
+JOIN_TIMEOUT = 5.0
+
+# Seconds a missing batch of membership changes is waited for.
+GAP_TIMEOUT = 2.0
+
 
 class PeerList(object):
 
@@ -21,6 +43,15 @@ class PeerList(object):
         self.owner = owner
         self.lock = threading.Condition()
         self.peers = {}
+        # Version of the membership seen so far, None when not watching.
+        self.version = None
+        # Batches of membership changes that arrived too early, by the
+        # version they start from.
+        self.deltas = {}
+        # Serializes the application of membership changes.
+        self.membership_lock = threading.Lock()
+        # Timer of the check for a missing batch, if one is pending.
+        self.gap_check = None
 
     # Public methods
 
@@ -39,19 +70,33 @@ class PeerList(object):
             #
             # Your code here.
             #
-            connected_peers = self.owner.name_service.require_all(self.owner.type)
+            self.owner.membership = self.membership_changed
+            membership = self.owner.name_service.watch(self.owner.type,
+                                                       self.owner.address)
             self.peers[self.owner.id] = orb.Stub(self.owner.address)
+            if not isinstance(membership, Exception):
+                self.version, connected_peers = membership
+            else:
+                self.owner.membership = None
+                connected_peers = self.owner.name_service.require_all(
+                    self.owner.type)
+            joined = []
             for pid, peer_addr in connected_peers:
                 if pid < self.owner.id:
                     self.peers[pid] = orb.Stub(peer_addr)
-                    peer = self.peers[pid]
-                    try:
-                        peer.register_peer(self.owner.id, self.owner.address)
-                    except:
-                        continue
-
+                    joined.append(pid)
+                elif self.version is not None and pid != self.owner.id:
+                    # Registered after us: it registers itself here.
+                    self.peers[pid] = orb.Stub(peer_addr)
+            peers = dict(self.peers)
         finally:
             self.lock.release()
+        # Outside of the lock, as the peers may call us meanwhile.
+        orb.gather({
+            pid: peers[pid].call_async("register_peer", self.owner.id,
+                                       self.owner.address)
+            for pid in joined
+        }, JOIN_TIMEOUT)
 
     def destroy(self):
         """Unregister this peer from all others in the list."""
@@ -62,24 +107,161 @@ class PeerList(object):
             # Your code here.
             #
             print("this is owner: ", self.owner.type)
+            if self.version is not None:
+                # The name service tells the others once we unregister.
+                self.owner.name_service.unwatch(self.owner.type,
+                                                self.owner.address)
+                self.owner.membership = None
+                self.version = None
+                return
             connected_peers = self.owner.name_service.require_all(self.owner.type)
             if isinstance(connected_peers, list):
                 for pid, _ in connected_peers:
-                    peer = self.peer(pid)
+                    # The list may be cached: skip the peers that left.
+                    if pid not in self.peers:
+                        continue
+                    peer = self.peers[pid]
                     try:
-                        peer.unregister_peer(self.owner.id)
+                        peer.send("unregister_peer", self.owner.id)
                     except:
                         continue
         finally:
             self.lock.release()
 
+    def membership_changed(self, otype, first, last, changes):
+        """Apply a batch of membership changes pushed by the name service.
+
+        The batch takes the membership from version first to last.
+        Batches are applied in order, those arriving early waiting for
+        the ones before them, through the owner's register_peer and
+        unregister_peer.
+
+        """
+
+        self.membership_lock.acquire()
+        try:
+            self.lock.acquire()
+            try:
+                if self.version is None or otype != self.owner.type:
+                    return
+                self.deltas[first] = (last, changes)
+                ready = []
+                while True:
+                    starts = [start for start in self.deltas
+                              if start <= self.version]
+                    if not starts:
+                        break
+                    for start in sorted(starts):
+                        last, changes = self.deltas.pop(start)
+                        ready.extend(change for change in changes
+                                     if change[0] > self.version)
+                        self.version = max(self.version, last)
+                ready.sort()
+                if self.deltas and self.gap_check is None:
+                    self._watch_gap()
+            finally:
+                self.lock.release()
+            # Outside of the lock, as the owner may need it or hold locks
+            # of its own taken before this one.
+            for _, pid, paddr in ready:
+                if pid == self.owner.id:
+                    continue
+                if paddr is not None and pid not in self.peers:
+                    self.owner.register_peer(pid, paddr)
+                elif paddr is None and pid in self.peers:
+                    self.owner.unregister_peer(pid)
+        finally:
+            self.membership_lock.release()
+
+    def discover(self, pid):
+        """Register a peer that called us before we heard of its joining.
+
+        Return False if the name service does not know the peer either.
+
+        """
+
+        paddr = self.owner.name_service.require_object(self.owner.type, pid)
+        if isinstance(paddr, Exception):
+            return False
+        self.lock.acquire()
+        try:
+            if pid in self.peers:
+                return True
+        finally:
+            self.lock.release()
+        self.owner.register_peer(pid, paddr)
+        return True
+
+    def resync(self):
+        """Watch the membership again and catch up with its snapshot.
+
+        The peers that joined or left meanwhile are registered or
+        unregistered through the owner, as if their changes had been
+        pushed.
+
+        """
+
+        self.membership_lock.acquire()
+        try:
+            membership = self.owner.name_service.watch(self.owner.type,
+                                                       self.owner.address)
+            if isinstance(membership, Exception):
+                return
+            version, current = membership
+            current = dict(current)
+            self.lock.acquire()
+            try:
+                if self.version is None:
+                    # Destroyed meanwhile.
+                    return
+                self.version = version
+                self.deltas = {}
+                joined = [(pid, paddr) for pid, paddr in current.items()
+                          if pid not in self.peers]
+                left = [pid for pid in self.peers
+                        if pid not in current and pid != self.owner.id]
+            finally:
+                self.lock.release()
+            for pid, paddr in joined:
+                self.owner.register_peer(pid, paddr)
+            for pid in left:
+                self.owner.unregister_peer(pid)
+        finally:
+            self.membership_lock.release()
+
+    def moved(self, old_id):
+        """Follow the owner, registered again under a new id.
+
+        The name service dropped the owner's watch along with its lost
+        lease, so the membership is watched again (see resync).
+
+        """
+
+        self.lock.acquire()
+        try:
+            stub = self.peers.pop(old_id, None)
+            self.peers[self.owner.id] = (stub if stub is not None
+                                         else orb.Stub(self.owner.address))
+            watching = self.version is not None
+        finally:
+            self.lock.release()
+        if watching:
+            self.resync()
+
     def register_peer(self, pid, paddr):
-        """Register a new peer joining the network."""
+        """Register a new peer joining the network.
+
+        A peer may be registered both by its own call and by the name
+        service's push: registering it again changes nothing.
+
+        """
 
         # Synchronize access to the peer list as several peers might call
         # this method in parallel.
         self.lock.acquire()
         try:
+            if pid in self.peers:
+                return
             self.peers[pid] = orb.Stub(paddr)
             print("Peer {} has joined the system.".format(pid))
         finally:
@@ -130,3 +312,30 @@ class PeerList(object):
             return self.peers
         finally:
             self.lock.release()
+
+    # Private methods
+
+    def _check_gap(self, version):
+        """Resync if no batch has been applied since version."""
+
+        self.lock.acquire()
+        try:
+            self.gap_check = None
+            stuck = (self.version is not None and self.version == version
+                     and self.deltas)
+            if not stuck and self.version is not None and self.deltas:
+                # Some batches came, another one is missing.
+                self._watch_gap()
+        finally:
+            self.lock.release()
+        if stuck:
+            print("Missed membership changes, watching again.")
+            self.resync()
+
+    def _watch_gap(self):
+        """Check for the missing batch later, the lock being held."""
+
+        self.gap_check = threading.Timer(GAP_TIMEOUT, self._check_gap,
+                                         (self.version,))
+        self.gap_check.daemon = True
+        self.gap_check.start()
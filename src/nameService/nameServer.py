@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Added to the lab framework: 18 October 2026
+# (not part of the original course material)
+# -----------------------------------------------------------------------------
+
+"""A name service that can be run locally, in place of the course's one.
+
+Start it, then point the peers to it through the environment variable
+read by nameServiceLocation, for instance:
+
+    ./nameServer.py -p 42424
+    TDDD25_NAME_SERVICE=localhost:42424 ../lab2/peer.py
+
+"""
+
+import sys
+import argparse
+
+sys.path.append("../modules")
+from Common import orb
+from Common.asyncOrb import AsyncSkeleton
+from Server.nameService import NameService
+
+# -----------------------------------------------------------------------------
+# Initialize and read the command line arguments
+# -----------------------------------------------------------------------------
+
+description = """Name service."""
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument(
+    "-p", "--port", metavar="PORT", dest="port", type=int, default=42424,
+    help="Set the port to listen to. Default: 42424."
+)
+parser.add_argument(
+    "-a", "--asyncio", action="store_true", dest="asyncio", default=False,
+    help="Serve requests from an asyncio event loop instead of one thread "
+         "per connection."
+)
+opts = parser.parse_args()
+
+# -----------------------------------------------------------------------------
+# The main program
+# -----------------------------------------------------------------------------
+
+skeleton_class = AsyncSkeleton if opts.asyncio else orb.Skeleton
+skeleton = skeleton_class(NameService(), ('', opts.port),
+                          unix_path=orb.unix_path(opts.port))
+skeleton.start()
+print("Name service listening to port {}.".format(opts.port))
+
+try:
+    skeleton.join()
+except KeyboardInterrupt:
+    pass
+skeleton.stop()